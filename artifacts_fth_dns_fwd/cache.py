@@ -0,0 +1,252 @@
+"""Content-addressed cache for derived DataFrames.
+
+An entry is keyed on
+ - the content digests of the input files (a digest is only recomputed when size or mtime of a file change),
+ - a fingerprint of the processing function: its source and the definitions of everything of this package
+   it references, following called functions recursively (see code_fingerprint),
+ - the remaining arguments of the call.
+
+Entries are stored as uncompressed Arrow IPC files. Polars results are memory-mapped on read instead of
+being deserialized, pandas results are converted by to_pandas, which copies the columns.
+The cache directory is kept below CACHE_MAX_BYTES by evicting the least recently used entries.
+"""
+
+import ast
+import hashlib
+import inspect
+import json
+import os
+from pathlib import Path
+import sys
+from typing import Callable, Iterable
+
+from loguru import logger
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+from artifacts_fth_dns_fwd.config import CACHE_DIR, CACHE_MAX_BYTES
+
+# bump to invalidate all entries, e.g. when the storage format changes
+CACHE_VERSION = 2
+
+# functions and constants of these modules are part of the code fingerprints
+FIRST_PARTY = "artifacts_fth_dns_fwd"
+
+_DIGESTS_FILE = "digests.json"
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path, cache_dir: Path = CACHE_DIR) -> str:
+    """sha256 of the file content, remembered per (size, mtime) so unchanged files are hashed once"""
+    path = Path(path).resolve()
+    stat = path.stat()
+    digests_file = cache_dir / _DIGESTS_FILE
+    digests = json.loads(digests_file.read_text()) if digests_file.exists() else {}
+    size, mtime, digest = digests.get(str(path), (None, None, None))
+    if size != stat.st_size or mtime != stat.st_mtime_ns:
+        digest = _sha256(path)
+        digests[str(path)] = (stat.st_size, stat.st_mtime_ns, digest)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = digests_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(digests))
+        os.replace(tmp, digests_file)
+    return digest
+
+
+def function_fingerprint(func: Callable) -> str:
+    """hash of the function source, falls back to the bytecode if the source is not available"""
+    try:
+        code = inspect.getsource(func).encode("utf-8")
+    except (OSError, TypeError):
+        code = func.__code__.co_code + repr(func.__code__.co_consts).encode("utf-8")
+    return hashlib.sha256(
+        f"{func.__module__}.{func.__qualname__}".encode("utf-8") + code
+    ).hexdigest()
+
+
+def _first_party(module_name) -> bool:
+    return module_name is not None and module_name.split(".")[0] == FIRST_PARTY
+
+
+_definitions_cache = {}
+
+
+def _module_definitions(module_name: str) -> dict:
+    """source of every top level definition (function, class, assignment) of the module by name"""
+    module = sys.modules[module_name]
+    mtime = os.stat(module.__file__).st_mtime_ns
+    if _definitions_cache.get(module_name, (None,))[0] != mtime:
+        source = inspect.getsource(module)
+        definitions = {}
+        for node in ast.parse(source).body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names = [node.name]
+            elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                names = [
+                    n.id for target in targets for n in ast.walk(target) if isinstance(n, ast.Name)
+                ]
+            else:
+                continue
+            for name in names:
+                # augmented assignments extend the definition
+                definitions[name] = definitions.get(name, "") + ast.get_source_segment(
+                    source, node
+                )
+        _definitions_cache[module_name] = (mtime, definitions)
+    return _definitions_cache[module_name][1]
+
+
+def _definition(name: str, value, module_name: str):
+    """source of the top level definition of a first-party name, None for anything else"""
+    modules = [module_name] + [m for m in sys.modules if _first_party(m) and m != module_name]
+    for candidate in modules:
+        if (
+            not _first_party(candidate)
+            or getattr(sys.modules.get(candidate), "__file__", None) is None
+        ):
+            continue
+        definitions = _module_definitions(candidate)
+        if name in definitions and getattr(sys.modules[candidate], name, None) is value:
+            return f"{candidate}.{name}:{definitions[name]}"
+    return None
+
+
+def _code_names(code) -> set:
+    """global and attribute names used by the code object and its nested functions, lambdas and comprehensions"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def code_fingerprint(func: Callable) -> str:
+    """
+    hash of the function and of the first-party code it depends on: the functions it calls (recursively),
+    module constants it reads (e.g. figure sizes, file paths) and the attributes it uses of first-party modules
+    (e.g. scans.tfwd). Names of other packages are not followed.
+    """
+    parts = []
+    seen = set()
+    stack = [func]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        parts.append(function_fingerprint(current))
+        code = getattr(current, "__code__", None)
+        if code is None:
+            continue
+        names = _code_names(code)
+        namespaces = [
+            (name, current.__globals__[name]) for name in names if name in current.__globals__
+        ]
+        # attributes of first-party modules, e.g. the tfwd of scans.tfwd
+        for name, value in list(namespaces):
+            if inspect.ismodule(value) and _first_party(value.__name__):
+                namespaces += [
+                    (attr, getattr(value, attr)) for attr in names if hasattr(value, attr)
+                ]
+        for name, value in sorted(namespaces, key=lambda item: item[0]):
+            if inspect.ismodule(value):
+                continue
+            if inspect.isfunction(value):
+                if _first_party(value.__module__):
+                    stack.append(value)
+                continue
+            definition = _definition(name, value, current.__module__)
+            if definition is not None:
+                parts.append(definition)
+    return hashlib.sha256("\n".join(sorted(set(parts))).encode("utf-8")).hexdigest()
+
+
+def cache_key(
+    func: Callable, inputs: Iterable, args: tuple, kwargs: dict, cache_dir: Path = CACHE_DIR
+) -> str:
+    key = {
+        "version": CACHE_VERSION,
+        "function": code_fingerprint(func),
+        "inputs": [file_digest(path, cache_dir) for path in inputs],
+        "args": repr(args),
+        "kwargs": repr(sorted(kwargs.items())),
+    }
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def _write(result, path: Path):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    if isinstance(result, pl.DataFrame):
+        result.write_ipc(tmp, compression="uncompressed")
+    elif isinstance(result, pd.DataFrame):
+        table = pa.Table.from_pandas(result)
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise TypeError(
+            f"only polars and pandas DataFrames can be cached, got {type(result).__name__}"
+        )
+    os.replace(tmp, path)
+
+
+def _read(path: Path):
+    # the buffers of the table point into the memory map, polars uses them without a copy,
+    # to_pandas copies the columns into pandas blocks
+    table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    if path.name.endswith(".pl.arrow"):
+        return pl.from_arrow(table)
+    return table.to_pandas()
+
+
+def evict(max_bytes: int = CACHE_MAX_BYTES, cache_dir: Path = CACHE_DIR):
+    """removes the least recently used entries until the cache holds at most max_bytes"""
+    entries = sorted(cache_dir.glob("*.arrow"), key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        entry.unlink()
+        logger.info(f"Evicted {entry.name} from the cache")
+
+
+def load_or_process(
+    process_func: Callable, inputs: Iterable, *args, cache_dir: Path = CACHE_DIR, **kwargs
+):
+    """
+    Load the result of process_func from the cache if neither the inputs nor the function changed,
+    otherwise run the processing function, cache the result, and return it.
+
+    Args:
+        process_func: Function to generate the DataFrame (polars or pandas).
+        inputs: Paths of the files the function reads.
+        cache_dir: Directory of the cache entries.
+        *args, **kwargs: Arguments passed to process_func, they are part of the cache key.
+
+    Returns:
+        DataFrame: The loaded or processed DataFrame.
+    """
+    inputs = list(inputs)
+    key = cache_key(process_func, inputs, args, kwargs, cache_dir)
+    for kind in ("pl", "pd"):
+        path = cache_dir / f"{process_func.__name__}-{key[:16]}.{kind}.arrow"
+        if path.exists():
+            # the mtime marks the last use for the eviction
+            os.utime(path)
+            logger.info(f"Loaded {process_func.__name__} from the cache")
+            return _read(path)
+    result = process_func(*args, **kwargs)
+    kind = "pl" if isinstance(result, pl.DataFrame) else "pd"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    _write(result, cache_dir / f"{process_func.__name__}-{key[:16]}.{kind}.arrow")
+    evict(CACHE_MAX_BYTES, cache_dir)
+    return result
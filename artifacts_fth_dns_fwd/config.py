@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -16,6 +17,10 @@ INTERIM_DATA_DIR = DATA_DIR / "interim"
 PROCESSED_DATA_DIR = DATA_DIR / "processed"
 EXTERNAL_DATA_DIR = DATA_DIR / "external"
 
+# derived data cache, see artifacts_fth_dns_fwd.cache
+CACHE_DIR = INTERIM_DATA_DIR / "cache"
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 8 * 2**30))
+
 REPORTS_DIR = PROJ_ROOT / "reports"
 FIGURES_DIR = REPORTS_DIR / "figures"
 
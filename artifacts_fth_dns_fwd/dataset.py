@@ -1,28 +1,69 @@
 from pathlib import Path
 
 from loguru import logger
+import polars as pl
 from tqdm import tqdm
 import typer
 
-from artifacts_fth_dns_fwd.config import PROCESSED_DATA_DIR, RAW_DATA_DIR
+from artifacts_fth_dns_fwd.scans import DNSSCAN_DIR, parquet_path
 
 app = typer.Typer()
 
+# rows per row group of the converted scan dataframes
+SCAN_ROW_GROUP_SIZE = 500_000
+
+
+def convert_scan_dataframe(csv_path, output_path, row_group_size: int = SCAN_ROW_GROUP_SIZE):
+    """Convert a dnsscan dataframe to a typed, zstd compressed parquet file sorted by response_type.
+
+    The types are inferred once here instead of on every read. Since the rows are sorted by
+    response_type, a filter on it skips the row groups whose statistics rule the type out.
+    The csv is streamed twice, once to check the timestamps and once into the sorted parquet
+    file, it is never held in memory as a whole.
+    """
+    lf = pl.scan_csv(csv_path, separator=";", infer_schema_length=100_000)
+    ts_columns = [
+        col
+        for col, dtype in lf.collect_schema().items()
+        if col.startswith("ts_") and dtype == pl.String
+    ]
+    # the timestamps are only converted if every value parses, unknown formats are kept as strings
+    parse = {
+        col: pl.col(col).str.strptime(pl.Datetime("us"), "%Y-%m-%d %H:%M:%S%.f", strict=False)
+        for col in ts_columns
+    }
+    counts = lf.select(
+        pl.len().alias("rows"),
+        *(
+            (parsed.null_count() == pl.col(col).null_count()).alias(col)
+            for col, parsed in parse.items()
+        ),
+    ).collect(engine="streaming")
+    lf.with_columns(parsed for col, parsed in parse.items() if counts[col].item()).sort(
+        "response_type", maintain_order=True
+    ).sink_parquet(output_path, compression="zstd", statistics=True, row_group_size=row_group_size)
+    return counts["rows"].item()
+
 
 @app.command()
 def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    input_path: Path = RAW_DATA_DIR / "dataset.csv",
-    output_path: Path = PROCESSED_DATA_DIR / "dataset.csv",
-    # ----------------------------------------------
+    input_path: Path = DNSSCAN_DIR,
+    pattern: str = "udp_dataframe_complete_*.csv*",
+    force: bool = False,
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Processing dataset...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
-    logger.success("Processing dataset complete.")
-    # -----------------------------------------
+    logger.info("Converting scan dataframes to parquet...")
+    for csv_path in tqdm(sorted(input_path.glob(pattern))):
+        output_path = parquet_path(csv_path)
+        if (
+            not force
+            and output_path.exists()
+            and output_path.stat().st_mtime >= csv_path.stat().st_mtime
+        ):
+            logger.info(f"{output_path.name} is up to date")
+            continue
+        rows = convert_scan_dataframe(csv_path, output_path)
+        logger.info(f"{csv_path.name} -> {output_path.name} ({rows} rows)")
+    logger.success("Converting scan dataframes complete.")
 
 
 if __name__ == "__main__":
@@ -9,8 +9,6 @@ from artifacts_fth_dns_fwd.config import FIGURES_DIR
 
 from tqdm import tqdm
 
-import os
-import pickle
 import itertools
 
 import pandas as pd
@@ -61,27 +59,5 @@ def save_plot(
         plt.close()
 
 
-def load_or_process_pickle(pickle_path, process_func, *args, **kwargs):
-    """
-    Load a DataFrame from a pickle file if it exists,
-    otherwise run the processing function, save the result, and return it.
-
-    Args:
-        pickle_path: Path to the pickle file.
-        process_func: Function to generate the DataFrame.
-        *args, **kwargs: Arguments passed to process_func.
-
-    Returns:
-        DataFrame: The loaded or processed DataFrame.
-    """
-    if os.path.exists(pickle_path):
-        with open(pickle_path, 'rb') as f:
-            return pickle.load(f)
-    else:
-        result = process_func(*args, **kwargs)
-        with open(pickle_path, 'wb') as f:
-            pickle.dump(result, f)
-        return result
-
 def flip(items, ncol):
     return list(itertools.chain(*[items[i::ncol] for i in range(ncol)]))
@@ -0,0 +1,132 @@
+"""Compact sets of IPv4 addresses.
+
+An IPv4Set is a sorted array of unique uint32 addresses: 4 bytes per address instead of a python
+string, membership of a whole column is one vectorized binary search and the set algebra works on the
+sorted arrays. A set is saved as a .npy file, loading memory-maps it, so several tools can share a set
+without parsing it again.
+"""
+
+from pathlib import Path
+from typing import Iterable, Union
+
+import numpy as np
+import polars as pl
+
+
+def _parse_ipv4(ips: pl.Series) -> pl.Series:
+    # the string is split once, the octets are then cast and combined as plain columns
+    octets = ips.str.splitn(".", 4).cast(
+        pl.Struct({f"field_{i}": pl.UInt32 for i in range(4)}), strict=False
+    )
+    octet = [pl.col(f"field_{i}") for i in range(4)]
+    value = (octet[0] * (1 << 24) + octet[1] * (1 << 16) + octet[2] * (1 << 8) + octet[3]).cast(
+        pl.UInt32
+    )
+    return (
+        octets.struct.unnest()
+        .select(pl.when(*(o <= 255 for o in octet)).then(value).alias(ips.name))
+        .to_series()
+    )
+
+
+def ipv4_to_uint32(ips: pl.Expr) -> pl.Expr:
+    """dotted IPv4 addresses to uint32, anything that is not an address becomes null"""
+    return ips.map_batches(_parse_ipv4, return_dtype=pl.UInt32, is_elementwise=True)
+
+
+def uint32_to_ipv4(values: pl.Expr) -> pl.Expr:
+    """uint32 values to dotted IPv4 addresses"""
+    return pl.concat_str(
+        [(values // (1 << shift) % 256).cast(pl.String) for shift in (24, 16, 8, 0)], separator="."
+    )
+
+
+def _addresses(values) -> pl.Series:
+    """addresses (dotted strings or integers) as uint32 series, invalid addresses are null"""
+    series = values if isinstance(values, pl.Series) else pl.Series(values)
+    if series.dtype == pl.String:
+        series = series.to_frame("ip").select(ipv4_to_uint32(pl.col("ip"))).to_series()
+    return series.cast(pl.UInt32, strict=False)
+
+
+class IPv4Set:
+    """immutable set of IPv4 addresses backed by a sorted uint32 array"""
+
+    def __init__(self, values: np.ndarray):
+        """values have to be sorted, unique and of dtype uint32, use the from_* constructors otherwise"""
+        self.values = values
+
+    @classmethod
+    def from_column(cls, values: Union[pl.Series, Iterable]) -> "IPv4Set":
+        """set of a column of dotted addresses or integers"""
+        return cls(np.unique(_addresses(values).drop_nulls().to_numpy()))
+
+    @classmethod
+    def from_frame(cls, frame: Union[pl.DataFrame, pl.LazyFrame], column: str) -> "IPv4Set":
+        """set of the addresses in column, lazy frames only collect the unique addresses"""
+        addresses = (
+            frame.lazy().select(ipv4_to_uint32(pl.col(column)).unique()).collect().to_series()
+        )
+        return cls(np.sort(addresses.drop_nulls().to_numpy()))
+
+    @classmethod
+    def load(cls, path, mmap: bool = True) -> "IPv4Set":
+        """set saved with save, memory-mapped read-only by default"""
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+    def save(self, path):
+        np.save(Path(path), self.values)
+
+    def contains(self, values) -> np.ndarray:
+        """membership of every address of values (dotted strings or integers), invalid addresses are not contained"""
+        series = _addresses(values)
+        valid = series.is_not_null().to_numpy()
+        addresses = series.fill_null(0).to_numpy()
+        if len(self.values) == 0:
+            return np.zeros(len(addresses), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.values, addresses), len(self.values) - 1)
+        return valid & (self.values[pos] == addresses)
+
+    def is_in(self, ips: pl.Expr) -> pl.Expr:
+        """expression testing a column of dotted addresses with the binary search of contains"""
+        return ips.map_batches(
+            lambda batch: pl.Series(self.contains(batch)),
+            return_dtype=pl.Boolean,
+            is_elementwise=True,
+        )
+
+    def to_series(self, name: str = "ip") -> pl.Series:
+        """the addresses as dotted strings in ascending order"""
+        return (
+            pl.Series(name, self.values, dtype=pl.UInt32)
+            .to_frame()
+            .select(uint32_to_ipv4(pl.col(name)))
+            .to_series()
+        )
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, ip) -> bool:
+        return bool(self.contains([ip])[0])
+
+    def __iter__(self):
+        return iter(self.to_series())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, IPv4Set) and np.array_equal(self.values, other.values)
+
+    def __or__(self, other: "IPv4Set") -> "IPv4Set":
+        return IPv4Set(np.union1d(self.values, other.values))
+
+    def __and__(self, other: "IPv4Set") -> "IPv4Set":
+        return IPv4Set(np.intersect1d(self.values, other.values, assume_unique=True))
+
+    def __sub__(self, other: "IPv4Set") -> "IPv4Set":
+        return IPv4Set(np.setdiff1d(self.values, other.values, assume_unique=True))
+
+    def __xor__(self, other: "IPv4Set") -> "IPv4Set":
+        return IPv4Set(np.setxor1d(self.values, other.values, assume_unique=True))
+
+    def __repr__(self) -> str:
+        return f"IPv4Set({len(self)} addresses)"
@@ -13,6 +13,7 @@ import pandas as pd
 import numpy as np
 
 import geopandas as gpd
+import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.lines as mlines
 from matplotlib.patches import Patch
@@ -24,64 +25,169 @@ from matplotlib.lines import Line2D
 from artifacts_fth_dns_fwd.config import *
 from artifacts_fth_dns_fwd.helper import *
 from artifacts_fth_dns_fwd.filter import *
+from artifacts_fth_dns_fwd import scans
+from artifacts_fth_dns_fwd.cache import code_fingerprint, file_digest, load_or_process
+from artifacts_fth_dns_fwd.rates import final_rate, read_capture, rolling_rate
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+
+# figures are only written to files, the Agg backend also works in the worker processes
+matplotlib.use("Agg")
 
 app = typer.Typer()
 
-@app.command()
-def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    input_path: Path = PROCESSED_DATA_DIR / "dataset.csv",
-    output_path: Path = FIGURES_DIR / "plot.png",
-    # -----------------------------------------
-):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Generating plot from data...")
-    data_dir = PROCESSED_DATA_DIR
-    figure_dir = FIGURES_DIR
-    dnsscan_data = f'{data_dir}/dnsscan'
-    mikrotik_measurement = f'{data_dir}/mikrotik-testing'
+DNSSCAN_DATA = PROCESSED_DATA_DIR / "dnsscan"
+MIKROTIK_MEASUREMENT = PROCESSED_DATA_DIR / "mikrotik-testing"
+RATELIMIT_TESTS = PROCESSED_DATA_DIR / "ratelimits"
+
+RESPONSE_TIMES_TFWD_VS_RFWD_FILE = PROCESSED_DATA_DIR / "response_times" / "response_times_tfwd_vs_rfwd.csv"
+RATES_FILE = RATELIMIT_TESTS / "rates_scan-24.08.2024_rate-29.08.2024_static_domain_newest_ver.csv"
+RATES_FILE_PUBLIC = RATELIMIT_TESTS / "rates_scan-24.08.2024_rate-01.10.2024_public_resolvers.csv"
+
+SCAN_DF_FILE = DNSSCAN_DATA / "udp_dataframe_complete_2025-01-06.csv.gz"
+
+RATES_SHIELDED_FILE = RATELIMIT_TESTS / "2025-01-12_15-40-44_rm-direct_dm-constant_incr-2000ms_max-rate-3000pps.csv"
+RATELIMIT_GOOGLE_FILE = RATELIMIT_TESTS / "2024-10-22_11-27-12_rm-direct_dm-constant_incr-2000ms_max-rate-3000pps-8.8.8.8.csv.gz"
+
+FREQ_OVER_TIME_DF_FILE = DNSSCAN_DATA / "frequency_per_type_over_time.csv"
+
+SCAN_OVERVIEW_FILE = DNSSCAN_DATA / "scan_overview.csv.gz"
+
+SHAPEFILE = PROCESSED_DATA_DIR / "shapefiles" / "ne_110m_admin_0_countries.shp"
+
+MIKROTIK_FILES = [
+    MIKROTIK_MEASUREMENT / "2025-04-08_15-11-09_recursive_1514_byte_TXT_non_fragmented" / "ratelimit_record_192.168.88.1.csv",
+    MIKROTIK_MEASUREMENT / "2025-04-08_15-14-11_recursive_3280_byte_TXT_fragmented_40_times_amplified" / "ratelimit_record_192.168.88.1.csv",
+    MIKROTIK_MEASUREMENT / "2025-04-09_13-32-56_transparent_1514_byte_TXT_non_fragmented_40000pps" / "ratelimit_record_192.168.88.1.csv",
+    MIKROTIK_MEASUREMENT / "2025-04-08_15-22-35_transparent_3280_byte_TXT_fragmented_40_times_amplified" / "ratelimit_record_192.168.88.1.csv",
+]
+
+STANDARD_FIGSIZE = (8 * 0.7, 5.5 * 0.5)
+WORLDMAP_FIGSIZE = (8*0.9,5*0.9)
+FIGSIZE_STABILITY_ODNS = (8 * 0.7, 5.5 * 0.3)
+FIGSIZE_TFWD_VS_RFWD = (8 * 0.7, 5 * 0.5)
+MIKROTIK_FIGSIZE = (8 * 0.7, 5 * 0.5)
+RATELIMIT_FIGSIZE = (8 * 0.7, 5.5 * 0.4)
+DATE_FORMATTER_MONTH_YEAR = DateFormatter("%b '%y")
+DATE_FORMATTER_MONTH_DAY_YEAR = DateFormatter("%b %d, '%y")
+
+
+def y_axis_formatter(x, pos):
+    if x >= 1_000_000:
+        return f'{x/1_000_000:.1f}M'
+    return f'{x/1_000:.0f}k'
+
 
-    response_times_tfwd_vs_rfwd_file = f'{data_dir}/response_times/response_times_tfwd_vs_rfwd.csv'
-    ratelimit_tests = f'{data_dir}/ratelimits'
-    rates_file = f'{ratelimit_tests}/rates_scan-24.08.2024_rate-29.08.2024_static_domain_newest_ver.csv'
-    rates_file_public = f'{ratelimit_tests}/rates_scan-24.08.2024_rate-01.10.2024_public_resolvers.csv'
+@dataclass
+class FigureTask:
+    """a single figure of the paper, rendered by func into reports/figures/<filename>"""
+    name: str
+    filename: str
+    inputs: List[Path]
+    func: Callable[[Path], None]
+    # functions the figure passes on instead of calling (e.g. to load_or_process), they are part of its fingerprint
+    uses: List[Callable] = field(default_factory=list)
 
-    scan_df_file = f'{dnsscan_data}/udp_dataframe_complete_2025-01-06.csv.gz'
+    def fingerprint(self) -> str:
+        # the figure, the helpers and constants it references and, recursively, the functions they call
+        code = "".join(code_fingerprint(func) for func in [self.func, *self.uses])
+        return hashlib.sha256(code.encode("utf-8")).hexdigest()
 
-    rates_shielded_file = f'{ratelimit_tests}/2025-01-12_15-40-44_rm-direct_dm-constant_incr-2000ms_max-rate-3000pps.csv'
-    ratelimit_google_file = f'{ratelimit_tests}/2024-10-22_11-27-12_rm-direct_dm-constant_incr-2000ms_max-rate-3000pps-8.8.8.8.csv.gz'
+    def state(self) -> dict:
+        """fingerprint and input digests as stored in the manifest, missing inputs have no digest"""
+        return {
+            "code": self.fingerprint(),
+            "inputs": {str(path): file_digest(path) if path.exists() else None for path in self.inputs},
+        }
 
-    freq_over_time_df_file = f'{dnsscan_data}/frequency_per_type_over_time.csv'
 
-    scan_overview_file = f'{dnsscan_data}/scan_overview.csv.gz'
+# figure name (figure_01) -> task, filled by the @figure decorator in paper order
+FIGURES: Dict[str, FigureTask] = {}
 
-    shapefile = f'{data_dir}/shapefiles/ne_110m_admin_0_countries.shp'
+# input digests and fingerprints of the figures last rendered into the output directory
+MANIFEST_NAME = "figures.manifest.json"
 
-    overview_df = pl.read_csv(scan_overview_file,separator=";")
-    scan_df = pl.read_csv(scan_df_file, separator=";")
-    frequency_odns_over_time = pl.read_csv(freq_over_time_df_file,separator=';')
 
+def figure(number: int, title: str, inputs: List[Path], uses: List[Callable] = ()):
+    """registers func(output) as figure <number>, inputs are the data files it reads"""
+    def register(func: Callable[[Path], None]):
+        name = f"figure_{number:0=2d}"
+        FIGURES[name] = FigureTask(name, f"{name}_{title}.pdf", list(inputs), func, list(uses))
+        return func
+    return register
 
-    standard_figsize = (8 * 0.7, 5.5 * 0.5)
-    worldmap_figsize = (8*0.9,5*0.9)
-    figsize_stability_odns = (8 * 0.7, 5.5 * 0.3)
-    figsize_tfwd_vs_rfwd = (8 * 0.7, 5 * 0.5)
-    mikrotik_figsize = (8 * 0.7, 5 * 0.5)
-    ratelimit_figsize = (8 * 0.7, 5.5 * 0.4)
-    date_formatter_month_year = DateFormatter("%b '%y")
-    date_formatter_month_day_year = DateFormatter("%b %d, '%y")
 
-    figure_counter = 0
+def stale_reasons(task: FigureTask, state: dict, entry: Optional[dict], output_dir: Path) -> List[str]:
+    """why the figure has to be rendered again, empty if its pdf is up to date"""
+    if not (output_dir / task.filename).exists():
+        return ["no pdf"]
+    if entry is None:
+        return ["not in the manifest"]
+    reasons = []
+    if entry["code"] != state["code"]:
+        reasons.append("code changed")
+    for path, digest in state["inputs"].items():
+        if digest is None:
+            reasons.append(f"{Path(path).name} is missing")
+        elif path not in entry["inputs"]:
+            reasons.append(f"new input {Path(path).name}")
+        elif entry["inputs"][path] != digest:
+            reasons.append(f"{Path(path).name} changed")
+    reasons += [f"{Path(path).name} is no input anymore" for path in entry["inputs"] if path not in state["inputs"]]
+    return reasons
 
-    def y_axis_formatter(x, pos):
-        if x >= 1_000_000:
-            return f'{x/1_000_000:.1f}M'
-        return f'{x/1_000:.0f}k'
 
+def load_manifest(manifest_file: Path) -> Dict[str, dict]:
+    if manifest_file.exists():
+        return json.loads(manifest_file.read_text())
+    return {}
 
-    figure_counter += 1
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
+def save_manifest(manifest_file: Path, manifest: Dict[str, dict]):
+    manifest_file.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+
+
+# ---- intermediates derived from the scan dataframes, cached via load_or_process ----
+
+def known_ases(scan_file) -> pl.DataFrame:
+    """all ASes seen in requests, responses and a-records of the non transparent forwarders"""
+    _nottfwd = scans.non_tfwd(scans.scan_dataframe(scan_file))
+    return pl.concat([
+        _nottfwd.select(pl.col(col).alias("asn")) for col in ["asn_request", "asn_response", "asn_arecord"]
+    ]).unique().collect()
+
+
+def shielded_tfwd_ases(scan_file) -> pl.DataFrame:
+    """number of shielded transparent forwarders per shielded resolver address and AS"""
+    return (
+        scans.shielded_tfwd(scans.scan_dataframe(scan_file))
+        .group_by(["ip_response", "asn_response"])
+        .agg(pl.len())
+        .collect()
+    )
+
+
+def tfwd_per_country(scan_file) -> pd.DataFrame:
+    """number of transparent forwarders per country of the request address"""
+    return (
+        scans.tfwd(scans.scan_dataframe(scan_file))
+        .select("country_request")
+        .collect()
+        .to_pandas()
+        .groupby("country_request", as_index=False)
+        .size()
+    )
+
+
+@figure(1, "number_odns_all_year", [SCAN_OVERVIEW_FILE], uses=[y_axis_formatter])
+def figure_01(output: Path):
+    overview_df = pl.read_csv(SCAN_OVERVIEW_FILE,separator=";")
     tmp_df = overview_df.with_columns(pl.col("Date").str.strptime(pl.Date, "%Y-%m-%d").alias("Date"))
     tmp_df = tmp_df.with_columns(
         (pl.col('# Recursive Forwarders') + pl.col('# Recursive Resolvers')).alias('# Other ODNS components')
@@ -92,7 +198,7 @@ def main(
     other = tmp_df["# Other ODNS components"].to_list()
 
 
-    plt.figure(figsize=standard_figsize)
+    plt.figure(figsize=STANDARD_FIGSIZE)
     plt.plot(dates, transparent_forwarders, marker='o', ms=3, label="# Transparent Forwarders",color="#31688e")
     plt.plot(dates, other, marker='o', ms=3, label="# Other ODNS components",color="#440154")
     plt.xlabel("Time [W]")
@@ -100,7 +206,7 @@ def main(
     plt.legend(loc="upper left", fontsize=9, ncols=2,bbox_to_anchor=(0,1.2))
     #plt.grid(True)
 
-    plt.gca().xaxis.set_major_formatter(date_formatter_month_year)
+    plt.gca().xaxis.set_major_formatter(DATE_FORMATTER_MONTH_YEAR)
     plt.gcf().autofmt_xdate(rotation=0,ha='center')
     plt.tight_layout()
     plt.annotate(
@@ -115,16 +221,17 @@ def main(
         fontsize=9
     )
     plt.gca().yaxis.set_major_formatter(FuncFormatter(y_axis_formatter))
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_number_odns_all_year.pdf', bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
 
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
-    response_times_df = pl.read_csv(response_times_tfwd_vs_rfwd_file,separator=';')
+@figure(4, "response_times", [RESPONSE_TIMES_TFWD_VS_RFWD_FILE])
+def figure_04(output: Path):
+    response_times_df = pl.read_csv(RESPONSE_TIMES_TFWD_VS_RFWD_FILE,separator=';')
     unique_countries = response_times_df["country_request"].unique()
     colorlist = {"USA":"#35b779","ARG":"#31688e","BRA":"#e3cf17","CHN":"#440154","IND":"#333254"}#{country: f"C{i}" for i, country in enumerate(unique_countries)}
 
-    fig,ax = fig_ax(standard_figsize)
+    fig,ax = fig_ax(STANDARD_FIGSIZE)
     for idx, country in enumerate(unique_countries):
         country_df = response_times_df.filter(pl.col("country_request") == country)
         ax.plot(
@@ -147,13 +254,13 @@ def main(
 
     # Show the plot
     plt.tight_layout()
-    figure_counter = 4
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_response_times.pdf', bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
 
-    fig, ax1 = plt.subplots(figsize=figsize_tfwd_vs_rfwd)#2,1, sharex= True, figsize=(8 * 0.7, 5.5 * 0.7), gridspec_kw={'height_ratios': [3, 1]})
+@figure(6, "tfwd_vs_rfwd_traffic_victim", [])
+def figure_06(output: Path):
+    fig, ax1 = plt.subplots(figsize=FIGSIZE_TFWD_VS_RFWD)#2,1, sharex= True, figsize=(8 * 0.7, 5.5 * 0.7), gridspec_kw={'height_ratios': [3, 1]})
     ax1.plot([0, 130], [0, 0.975], linestyle='-', color='#5ec962', zorder=1) #rising slope rfwd
     ax1.plot([130, 600], [0.975, 0.975], linestyle='-', color='#5ec962', zorder=1) #rfwd horizontal
     ax1.plot([0, 600], [0, 13.4], linestyle='-', color='#e3cf17', zorder=1) #tfwd
@@ -201,19 +308,13 @@ def main(
 
     plt.xlim([0,600])
     plt.tight_layout()
-    figure_counter = 6
-    plt.savefig(f"{figure_dir}/figure_{figure_counter:0=2d}_tfwd_vs_rfwd_traffic_victim.pdf", bbox_inches="tight")
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
 
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
-    # In[10]:
-
-
-    files = [f"{mikrotik_measurement}/2025-04-08_15-11-09_recursive_1514_byte_TXT_non_fragmented/ratelimit_record_192.168.88.1.csv",
-            f"{mikrotik_measurement}/2025-04-08_15-14-11_recursive_3280_byte_TXT_fragmented_40_times_amplified/ratelimit_record_192.168.88.1.csv",
-            f"{mikrotik_measurement}/2025-04-09_13-32-56_transparent_1514_byte_TXT_non_fragmented_40000pps/ratelimit_record_192.168.88.1.csv",
-            f"{mikrotik_measurement}/2025-04-08_15-22-35_transparent_3280_byte_TXT_fragmented_40_times_amplified/ratelimit_record_192.168.88.1.csv"]
+@figure(7, "mikrotik_comparison", MIKROTIK_FILES)
+def figure_07(output: Path):
+    files = MIKROTIK_FILES
     measurements = ["rec_1514",
                     "rec_3280",
                     "trans_1514",
@@ -263,8 +364,7 @@ def main(
 
 
     colorlist = ["#e3cf17","#5ec962","#e3cf17","#5ec962"]
-    markers = ["1","2","3","4","+","x"]
-    plt.figure(figsize=ratelimit_figsize)
+    plt.figure(figsize=RATELIMIT_FIGSIZE)
     ax = plt.gca()
     for idx, measurement in enumerate(measurements):
         df_part = mikrotik_df.filter(mikrotik_df["tag"] == measurement)
@@ -300,14 +400,13 @@ def main(
     )
 
     #plt.tight_layout()
-    figure_counter+=1
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_mikrotik_comparison.pdf',bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
-
-    # In[12]:
 
+@figure(9, "number_tfwd_year", [SCAN_OVERVIEW_FILE], uses=[y_axis_formatter])
+def figure_09(output: Path):
+    overview_df = pl.read_csv(SCAN_OVERVIEW_FILE,separator=";")
 
     tmp_df = overview_df.with_columns(pl.col("Date").str.strptime(pl.Date, "%Y-%m-%d").alias("Date"))
     tmp_df = tmp_df.with_columns(
@@ -317,9 +416,8 @@ def main(
 
     dates = tmp_df["Date"].to_list()
     transparent_forwarders = tmp_df["# Transparent Forwarders"].to_list()
-    other = tmp_df["# Other ODNS components"].to_list()
 
-    plt.figure(figsize=ratelimit_figsize)
+    plt.figure(figsize=RATELIMIT_FIGSIZE)
     plt.plot(dates, transparent_forwarders, marker='o', ms=3, label="# Transparent Forwarders",color="#31688e")
     #plt.plot(dates, other, marker='o', ms=3, label="# Other ODNS components",color="#440154")
     plt.xlabel("Time [W]")
@@ -327,24 +425,21 @@ def main(
     plt.legend(loc="upper left", fontsize=9, ncols=2,bbox_to_anchor=(0,1))
     plt.ylim(400000,800000)
     #plt.grid(True)
-    plt.gca().xaxis.set_major_formatter(date_formatter_month_year)
+    plt.gca().xaxis.set_major_formatter(DATE_FORMATTER_MONTH_YEAR)
     plt.gcf().autofmt_xdate(rotation=0,ha='center')
     plt.tight_layout()
 
     plt.gca().yaxis.set_major_formatter(FuncFormatter(y_axis_formatter))
-    figure_counter+=2
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_number_tfwd_year.pdf', bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
-
-    # In[13]:
-
 
+@figure(10, "ratelimit_resolvers", [RATES_FILE, RATES_FILE_PUBLIC])
+def figure_10(output: Path):
     max_rate = 3100
-    rates_header_df = pd.read_csv(rates_file, sep=';', names=['resolver_ip','max_rate', 'end_rate'])
+    rates_header_df = pd.read_csv(RATES_FILE, sep=';', names=['resolver_ip','max_rate', 'end_rate'])
 
-    rates_header_df_pub = pd.read_csv(rates_file_public, sep=';', names=['resolver_ip','max_rate', 'end_rate'])
+    rates_header_df_pub = pd.read_csv(RATES_FILE_PUBLIC, sep=';', names=['resolver_ip','max_rate', 'end_rate'])
 
     bins = np.arange(0, rates_header_df['max_rate'].max() + 100, 100)
 
@@ -352,7 +447,7 @@ def main(
     drop_rates = rates_header_df[rates_header_df['max_rate'] < max_rate]['max_rate']
     drop_rates_pub = rates_header_df_pub[rates_header_df_pub['max_rate'] < max_rate]['max_rate']
 
-    plt.figure(figsize=ratelimit_figsize)
+    plt.figure(figsize=RATELIMIT_FIGSIZE)
     plt.gca().grid(True, which='major', linestyle='--', linewidth=0.5, zorder=0)
     bins = np.arange(-99, drop_rates.max() + 100, 100)
     counts, bins, patches = plt.hist(drop_rates_pub, bins=bins, edgecolor='black', color='white', zorder=2) #lightskyblue
@@ -396,47 +491,32 @@ def main(
 
     plt.xlabel('Rate Limit [pps]')
     plt.ylabel('Resolvers [#]')
-    figure_counter += 1
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_ratelimit_resolvers.pdf', bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
 
     plt.close()
 
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
-    # In[14]:
-
-
-    _nottfwd = scan_df.filter(pl.col("response_type") != "Transparent Forwarder")
-    known_ases = list(set(_nottfwd["asn_request"].to_list() + _nottfwd["asn_response"].to_list() + _nottfwd["asn_arecord"].to_list()))
+@figure(11, "rrls_new_ases", [scans.scan_source(SCAN_DF_FILE), RATES_SHIELDED_FILE],
+        uses=[known_ases, shielded_tfwd_ases])
+def figure_11(output: Path):
+    scan_inputs = [scans.scan_source(SCAN_DF_FILE)]
+    _known_ases = load_or_process(known_ases, scan_inputs, SCAN_DF_FILE)["asn"].to_list()
 
-    response_addresses = (
-        scan_df
-        .filter(pl.col("response_type") != "Transparent Forwarder")
-        .select("ip_response")
-        .unique()
-        .to_series()
-        .to_list()
-    )
-
-    tfwd_shielded_df = (
-        scan_df
-        .filter(pl.col("response_type") == "Transparent Forwarder")
-        .filter(~pl.col("ip_response").is_in(response_addresses))
-    )
+    tfwd_shielded_ases = load_or_process(shielded_tfwd_ases, scan_inputs, SCAN_DF_FILE)
     _shielded_ases = (
-        tfwd_shielded_df
+        tfwd_shielded_ases
         .select("asn_response")
         .unique()
     )
     new_ases = (
         _shielded_ases
-        .filter(~pl.col("asn_response").is_in(known_ases))
+        .filter(~pl.col("asn_response").is_in(_known_ases))
         .to_series()
         .to_list()
     )
 
     rates_shielded = pl.read_csv(
-        rates_shielded_file,
+        RATES_SHIELDED_FILE,
         separator=";",
         has_header=False,
         new_columns=["ip","max_rate","end_rate"]
@@ -445,7 +525,7 @@ def main(
     new_as_tfwds_rate = (
         rates_shielded
         .join(
-            tfwd_shielded_df.select("ip_response","asn_response").group_by(["ip_response","asn_response"]).agg(pl.len()),
+            tfwd_shielded_ases,
             left_on = "ip",
             right_on = "ip_response",
             how = "left"
@@ -466,7 +546,7 @@ def main(
         ).sort(by="max_rate_asn", descending=True)
     )
 
-    plt.figure(figsize=figsize_stability_odns)
+    plt.figure(figsize=FIGSIZE_STABILITY_ODNS)
     plt.plot(range(1,new_as_tfwds_rate.select(pl.len()).item()+1),
             new_as_tfwds_rate.sort(by="max_rate",descending=True)["max_rate"],
             color="#31688e")
@@ -497,18 +577,17 @@ def main(
     plt.ylabel("Response Rate\nLimit [pps]")
     plt.xlim([0,250])
     plt.ylim([0,6500])
-    figure_counter+=1
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_rrls_new_ases.pdf', bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
-
-    # In[15]:
 
+@figure(12, "stability_of_odns_components", [FREQ_OVER_TIME_DF_FILE])
+def figure_12(output: Path):
+    frequency_odns_over_time = pl.read_csv(FREQ_OVER_TIME_DF_FILE,separator=';')
 
     response_types = frequency_odns_over_time['response_type'].unique()
     markers = ['.', '+', '2', 'x', 'D', '*']
-    plt.figure(figsize=figsize_stability_odns)
+    plt.figure(figsize=FIGSIZE_STABILITY_ODNS)
     colorlist = ["#35b779","#440154","#e3cf17","#31688e"]
     for i, response_type in enumerate(sorted(response_types)):
         subset = frequency_odns_over_time.filter(pl.col('response_type') == response_type)
@@ -522,32 +601,30 @@ def main(
     plt.xlabel('Recurrence [#]')
     plt.ylabel('Frequency [%]  ')
     #plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-    figure_counter += 1
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_stability_of_odns_components.pdf', bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
-
-    # In[16]:
-
 
-    gdf = gpd.read_file(shapefile)[["ADMIN","ADM0_A3","geometry"]]    
+@figure(13, "worldmap_tfwd_deployment", [scans.scan_source(SCAN_DF_FILE), SHAPEFILE], uses=[tfwd_per_country])
+def figure_13(output: Path):
+    scan_inputs = [scans.scan_source(SCAN_DF_FILE)]
+    gdf = gpd.read_file(SHAPEFILE)[["ADMIN","ADM0_A3","geometry"]]    
     gdf.columns = ["country","country_code","geometry"]    
     gdf = gdf.drop(gdf[gdf["country"]=="Antarctica"].index)
-    geodata = gdf.merge(scan_df.filter(pl.col('response_type')=='Transparent Forwarder').to_pandas().groupby('country_request',as_index=False).size(), left_on = 'country_code', right_on = 'country_request',how="left")
+    geodata = gdf.merge(load_or_process(tfwd_per_country, scan_inputs, SCAN_DF_FILE), left_on = 'country_code', right_on = 'country_request',how="left")
     geodata['size'] = geodata['size'].fillna(1)
 
 
     # In[17]:
 
 
-    fig, ax = plt.subplots(figsize=worldmap_figsize)
+    fig, ax = plt.subplots(figsize=WORLDMAP_FIGSIZE)
     ax.axis("off")
 
     divider = make_axes_locatable(ax)
     cax = divider.append_axes("bottom", size="5%", pad=0.1)
 
-    geodata.plot(column="size", figsize=worldmap_figsize,cmap="viridis",legend=True, 
+    geodata.plot(column="size", figsize=WORLDMAP_FIGSIZE,cmap="viridis",legend=True, 
                 norm=colors.LogNorm(vmin=geodata["size"].min(), vmax=geodata["size"].max()),
                 legend_kwds={"label": "Transparent Forwarders per Country [#]", "orientation": "horizontal","shrink":.75,'location':'bottom'},
                 cax=cax,ax=ax,edgecolor='grey')
@@ -555,19 +632,14 @@ def main(
     ax.set_xlim(-160,180)
     ax.set_ylim(-60,85)
 
-    figure_counter += 1
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_worldmap_tfwd_deployment.pdf',bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     # save and clean up
     plt.close()
 
-    logger.info(f"Generating Figure {figure_counter:0=2d}...")
 
-    # In[18]:
-
-
-    ratelimit_google = pd.read_csv(ratelimit_google_file, parse_dates=True, sep=';', names=['tfwd-ip','timestamp','payload'],skiprows=11,usecols=range(1,4))
-
-    ratelimit_google['timestamp']= pd.to_datetime(ratelimit_google['timestamp'], unit='us')
+@figure(14, "google_rate_limit_multiple_countries", [RATELIMIT_GOOGLE_FILE], uses=[read_capture, rolling_rate, final_rate])
+def figure_14(output: Path):
+    ratelimit_google = read_capture(RATELIMIT_GOOGLE_FILE)
 
     # List of IPs and their corresponding labels for the plot
     ip_list = [
@@ -596,21 +668,14 @@ def main(
         '196.251.197.247': 'ZAF'
     }
 
-    min_timestamp = ratelimit_google['timestamp'].min()
-
-    rate_arr = []
-    for i, (ip, label) in enumerate(ip_list):
-        df_sub = ratelimit_google[ratelimit_google['tfwd-ip'] == ip]
-        df_sub = df_sub.set_index('timestamp').sort_index()
-        rolling_count = df_sub.rolling('1s').count()['payload']
-        # Convert the time index to seconds relative to min_timestamp
-        relative_time_index = (rolling_count.index - min_timestamp).total_seconds()
-        rate_arr.append((ip_list_map[ip],rolling_count.iloc[-1]))
-        
+    # rate of every forwarder within the last second of its capture
+    final_rates = dict(final_rate(ratelimit_google.filter(pl.col('source').is_in(list(ip_list_map)))).iter_rows())
+    rate_arr = [(ip_list_map[ip], final_rates[ip]) for ip, label in ip_list]
+
     rate_arr.sort(key=lambda x: x[1], reverse=True)
     x=[rate[0] for rate in rate_arr]
     y=[rate[1] for rate in rate_arr]
-    plt.figure(figsize=ratelimit_figsize)
+    plt.figure(figsize=RATELIMIT_FIGSIZE)
     plt.grid(axis="y")
     plt.bar(x,y, color="#31688e", width=0.5, zorder=3)
     plt.hlines(y=1500,xmin=-1, xmax=9.5, color='red',linestyle='--',zorder=2,label="Listed rate limit by Google")
@@ -618,11 +683,79 @@ def main(
     plt.ylabel("Rate Limit [pps]")
     plt.xlim([-0.5,9.5])
     plt.legend(fontsize=9)
-    figure_counter += 1
-    plt.savefig(f'{figure_dir}/figure_{figure_counter:0=2d}_google_rate_limit_multiple_countries.pdf', bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
     plt.close()
+
+
+def render(name: str, output_dir: Path) -> str:
+    """renders a single registered figure, also the entry point of the worker processes"""
+    task = FIGURES[name]
+    logger.info(f"Generating {task.filename}...")
+    task.func(output_dir / task.filename)
+    plt.close("all")
+    return task.filename
+
+
+def render_all(names: List[str], output_dir: Path, jobs: int) -> Iterator[Tuple[str, bool]]:
+    """renders the figures, yields (name, success) in the order they finish"""
+    if jobs <= 1:
+        for name in names:
+            try:
+                render(name, output_dir)
+            except Exception:
+                logger.exception(f"Generating {name} failed")
+                yield name, False
+            else:
+                yield name, True
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(render, name, output_dir): name for name in names}
+        for future in as_completed(futures):
+            try:
+                logger.info(f"Finished {future.result()}")
+            except Exception:
+                logger.exception(f"Generating {futures[future]} failed")
+                yield futures[future], False
+            else:
+                yield futures[future], True
+
+
+@app.command()
+def main(
+    output_dir: Path = FIGURES_DIR,
+    jobs: int = typer.Option(1, help="number of processes rendering figures in parallel"),
+    only: Optional[List[str]] = typer.Option(None, help="only generate the given figure(s), e.g. figure_07"),
+    force: bool = typer.Option(False, help="render the figures even if they are up to date"),
+):
+    names = only or list(FIGURES)
+    unknown = [name for name in names if name not in FIGURES]
+    if unknown:
+        raise typer.BadParameter(f"unknown figure(s) {', '.join(unknown)}, available: {', '.join(FIGURES)}")
+    manifest_file = output_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_file)
+    states = {}
+    for name in names:
+        task = FIGURES[name]
+        state = task.state()
+        reasons = ["forced"] if force else stale_reasons(task, state, manifest.get(name), output_dir)
+        if reasons:
+            logger.info(f"Rebuilding {task.filename}: {', '.join(reasons)}")
+            states[name] = state
+        else:
+            logger.info(f"{task.filename} is up to date")
+    logger.info(f"Generating {len(states)} figure(s) with {jobs} job(s)...")
+    failed = []
+    for name, success in render_all(list(states), output_dir, jobs):
+        if success:
+            manifest[name] = states[name]
+        else:
+            manifest.pop(name, None)
+            failed.append(name)
+    save_manifest(manifest_file, manifest)
+    if failed:
+        logger.error(f"Failed figures: {', '.join(sorted(failed))}")
+        raise typer.Exit(1)
     logger.success("Plot generation complete.")
-    # -----------------------------------------
 
 
 if __name__ == "__main__":
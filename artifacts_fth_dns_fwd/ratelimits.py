@@ -0,0 +1,223 @@
+"""Rate limits of public resolvers measured from multiple points of presence.
+
+The measurements are stored as ratelimits-multiple-pops/<CC>/<scan>/ where every scan folder holds
+ - rates.csv: resolver_ip;max_rate;end_rate as reported by the rate limit tester,
+ - <resolver ip>.csv.gz: the capture of the resolver, a resolver_ip;max_rate;end_rate line
+   followed by one timestamp [us];dns payload size line per received response.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import re
+from typing import List, Optional
+
+from loguru import logger
+import polars as pl
+import typer
+
+from artifacts_fth_dns_fwd.config import PROCESSED_DATA_DIR
+
+app = typer.Typer()
+
+RATELIMITS_MULTIPOP_DIR = PROCESSED_DATA_DIR / "ratelimits-multiple-pops"
+
+RATE_SCHEMA = {"resolver_ip": pl.String, "max_rate": pl.Int64, "end_rate": pl.Int64}
+TIMESTAMP_SCHEMA = {"timestamp": pl.Int64, "payload": pl.Int64}
+
+# the tester sends every rate step for <increment> ms and waits <wait> ms for late responses before the next step
+DEFAULT_INCREMENT_MS = 2000
+DEFAULT_WAIT_MS = 0
+
+
+def discover_scans(root=RATELIMITS_MULTIPOP_DIR) -> List[Path]:
+    """all <CC>/<scan> folders below root, sorted by country and scan"""
+    return sorted(
+        scan_dir
+        for country_dir in Path(root).iterdir()
+        if country_dir.is_dir() and "ipynb_checkpoints" not in country_dir.name
+        for scan_dir in country_dir.iterdir()
+        if scan_dir.is_dir() and "ipynb_checkpoints" not in scan_dir.name
+    )
+
+
+def increment_ms(scan_dir) -> int:
+    """rate increase interval from the scan folder name (..._incr-2000_...)"""
+    match = re.search(r"_incr-(\d+)", Path(scan_dir).name)
+    return int(match.group(1)) if match else DEFAULT_INCREMENT_MS
+
+
+def wait_ms(scan_dir) -> int:
+    """wait interval after every rate step from the scan folder name (..._wait1000ms_...)"""
+    match = re.search(r"_wait(\d+)ms", Path(scan_dir).name)
+    return int(match.group(1)) if match else DEFAULT_WAIT_MS
+
+
+def read_rates(scan_dir) -> pl.DataFrame:
+    """rates.csv of a scan with the country and date of the scan (resolver_ip | max_rate | end_rate | date | country)"""
+    scan_dir = Path(scan_dir)
+    return pl.read_csv(
+        scan_dir / "rates.csv",
+        separator=";",
+        has_header=False,
+        new_columns=list(RATE_SCHEMA),
+        schema=RATE_SCHEMA,
+    ).with_columns(
+        date=pl.lit(scan_dir.name.split("_")[0]).str.to_datetime("%Y-%m-%d"),
+        country=pl.lit(scan_dir.parent.name),
+        scan=pl.lit(scan_dir.name),
+    )
+
+
+def read_timestamps(path) -> pl.DataFrame:
+    """responses of a single resolver capture (timestamp [us] | payload), the header line is skipped"""
+    return pl.read_csv(
+        path,
+        separator=";",
+        has_header=False,
+        skip_rows=1,
+        new_columns=list(TIMESTAMP_SCHEMA),
+        schema=TIMESTAMP_SCHEMA,
+    ).drop_nulls(
+        "timestamp"
+    )  # some polars versions read a header-only capture as a single null row
+
+
+def step_counts(packets: pl.DataFrame, increment_us: int, wait_us: int = 0) -> pl.DataFrame:
+    """Responses per rate step, counted like calc_last_second_rate of the tester (ratelimit.go).
+
+    The tester sends every step for increment and waits wait before counting the responses of the
+    step in a single window of increment length, anchored at the first response of the step. The
+    captures hold no send times, but the tester stops at the end of its last step, so the steps are
+    laid out backwards from the last response of a resolver, one every increment + wait. The first
+    step of a capture may be cut off. The tester counts per subroutine and sums the counts, the
+    captures do not tell the subroutines apart and are counted as a whole.
+
+    Args:
+        packets (pl.DataFrame): resolver_ip | timestamp [us]
+        increment_us (int): send duration of a step
+        wait_us (int): wait after every step
+
+    Returns:
+        pl.DataFrame: resolver_ip | step | count, ordered by resolver and step
+    """
+    steps_from_end = (pl.col("timestamp").max().over("resolver_ip") - pl.col("timestamp")) // (
+        increment_us + wait_us
+    )
+    steps = packets.lazy().select(
+        "resolver_ip",
+        "timestamp",
+        step=steps_from_end.max().over("resolver_ip") - steps_from_end,
+    )
+    first_response = pl.col("timestamp").min()
+    return (
+        steps.group_by("resolver_ip", "step")
+        .agg(count=(pl.col("timestamp") - first_response < increment_us).sum())
+        .sort("resolver_ip", "step")
+        .collect()
+    )
+
+
+def capture_rates(scan_dir) -> pl.DataFrame:
+    """Recompute the rates of all resolvers of a scan from their captures.
+
+    The responses are counted per rate step (see step_counts): max_rate is the highest and end_rate
+    the last of these counts, both in responses per second and rounded like rates.csv.
+    Resolvers without any response get a rate of 0.
+
+    Returns:
+        pl.DataFrame: resolver_ip | max_rate | end_rate | country | scan
+    """
+    scan_dir = Path(scan_dir)
+    increment = increment_ms(scan_dir)
+    captures = sorted(scan_dir.glob("*.csv.gz"))
+    resolvers = [path.name.removesuffix(".csv.gz") for path in captures]
+    packets = pl.concat(
+        [
+            read_timestamps(path).with_columns(resolver_ip=pl.lit(ip))
+            for path, ip in zip(captures, resolvers)
+        ]
+        or [pl.DataFrame(schema={**TIMESTAMP_SCHEMA, "resolver_ip": pl.String})]
+    )
+    rates = (
+        step_counts(packets, increment * 1000, wait_ms(scan_dir) * 1000)
+        .group_by("resolver_ip")
+        .agg(max_rate=pl.col("count").max(), end_rate=pl.col("count").last())
+        .with_columns(pl.col("max_rate", "end_rate").cast(pl.Int64))
+        # responses per second, rounded half up like math.Round in the tester
+        .with_columns((pl.col("max_rate", "end_rate") * 2000 + increment) // (2 * increment))
+    )
+    return (
+        pl.DataFrame({"resolver_ip": resolvers}, schema={"resolver_ip": pl.String})
+        .join(rates, on="resolver_ip", how="left")
+        .with_columns(
+            pl.col("max_rate", "end_rate").fill_null(0),
+            country=pl.lit(scan_dir.parent.name),
+            scan=pl.lit(scan_dir.name),
+        )
+    )
+
+
+def _load(func, root, workers: Optional[int]) -> pl.DataFrame:
+    scan_dirs = discover_scans(root)
+    # polars and numpy release the GIL while parsing and counting, threads are sufficient
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tables = list(executor.map(func, scan_dirs))
+    logger.info(f"Loaded {len(scan_dirs)} scans from {root}")
+    return pl.concat(tables).sort(["country", "scan"], maintain_order=True)
+
+
+def load_rates(root=RATELIMITS_MULTIPOP_DIR, workers: Optional[int] = None) -> pl.DataFrame:
+    """rates.csv of all scans in one table, ordered by country and scan"""
+    return _load(read_rates, root, workers)
+
+
+def load_capture_rates(
+    root=RATELIMITS_MULTIPOP_DIR, workers: Optional[int] = None
+) -> pl.DataFrame:
+    """rates recomputed from the captures of all scans, see capture_rates"""
+    return _load(capture_rates, root, workers)
+
+
+def compare_rates(root=RATELIMITS_MULTIPOP_DIR, workers: Optional[int] = None) -> pl.DataFrame:
+    """reported and recomputed rates side by side with their relative deviation"""
+    reported = load_rates(root, workers)
+    recomputed = load_capture_rates(root, workers).select(
+        "resolver_ip", "scan", "country", "max_rate", "end_rate"
+    )
+    return reported.join(
+        recomputed,
+        on=["resolver_ip", "scan", "country"],
+        how="left",
+        suffix="_capture",
+        maintain_order="left",
+    ).with_columns(
+        (
+            (pl.col(f"{rate}_capture") - pl.col(rate)).abs()
+            / pl.max_horizontal(pl.col(rate), pl.lit(1))
+        ).alias(f"{rate}_deviation")
+        for rate in ("max_rate", "end_rate")
+    )
+
+
+@app.command()
+def main(
+    root: Path = RATELIMITS_MULTIPOP_DIR,
+    workers: Optional[int] = None,
+    tolerance: float = 0.05,
+    output: Optional[Path] = None,
+):
+    logger.info("Comparing the reported rates with the captures...")
+    comparison = compare_rates(root, workers)
+    for rate in ("max_rate", "end_rate"):
+        deviating = comparison.filter(pl.col(f"{rate}_deviation") > tolerance)
+        logger.info(
+            f"{rate}: {deviating.height} of {comparison.height} resolvers deviate by more than {tolerance:.0%}"
+        )
+    if output is not None:
+        comparison.write_csv(output, separator=";")
+        logger.info(f"Wrote the comparison to {output}")
+    logger.success("Comparing rates complete.")
+
+
+if __name__ == "__main__":
+    app()
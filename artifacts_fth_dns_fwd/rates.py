@@ -0,0 +1,87 @@
+import gzip
+from typing import List
+
+import numpy as np
+import polars as pl
+
+# dns-response lines of a ratelimit capture
+CAPTURE_COLUMNS = ["kind", "source", "timestamp", "payload"]
+
+
+def capture_header(path) -> List[List[str]]:
+    """Header lines of a ratelimit capture (<ip>.csv.gz).
+
+    The header consists of the probed resolver (ip;max_rate;end_rate) followed by one
+    rate-data;<forwarder ip>;<rate> line per probed forwarder.
+    """
+    header = []
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            if line.startswith("dns-response;"):
+                break
+            header.append(line.rstrip("\n").split(";"))
+    return header
+
+
+def read_capture(path) -> pl.DataFrame:
+    """Responses of a ratelimit capture: source ip, timestamp [us] and payload size per received packet."""
+    return (
+        pl.read_csv(
+            path,
+            separator=";",
+            has_header=False,
+            skip_rows=len(capture_header(path)),
+            new_columns=CAPTURE_COLUMNS,
+            schema_overrides={"source": pl.String, "timestamp": pl.Int64, "payload": pl.Int64},
+        )
+        .filter(pl.col("kind") == "dns-response")
+        .drop("kind")
+    )
+
+
+def rolling_rate(
+    packets: pl.DataFrame,
+    source: str = "source",
+    timestamp: str = "timestamp",
+    window_us: int = 1_000_000,
+) -> pl.DataFrame:
+    """Packets per window for every packet of every source.
+
+    The rate of a packet at time t is the number of packets of the same source within (t - window, t],
+    i.e. the same as pandas' rolling('1s').count() on the time index of every single source.
+    All sources are handled in one pass: the packets are sorted by (source, timestamp) once and the
+    window start of every packet is found with a searchsorted on a composite (source, timestamp) key.
+
+    Args:
+        packets: one row per packet
+        source: column identifying the sender
+        timestamp: integer timestamp column in microseconds
+        window_us: window length in microseconds
+
+    Returns:
+        pl.DataFrame: packets sorted by source and timestamp with an additional rate column
+    """
+    packets = packets.sort([source, timestamp], maintain_order=True)
+    if packets.height == 0:
+        return packets.with_columns(rate=pl.lit(0, dtype=pl.Int64))
+    codes = packets.select(pl.col(source).rle_id()).to_series().to_numpy().astype(np.int64)
+    ts = packets[timestamp].cast(pl.Int64).to_numpy()
+    ts = ts - ts.min()
+    # the sources are spaced further apart than a window, so a window never reaches into the previous source
+    keys = codes * (int(ts.max()) + window_us + 1) + ts
+    start = np.searchsorted(keys, keys - window_us, side="right")
+    return packets.with_columns(rate=pl.Series(np.arange(len(keys)) - start + 1, dtype=pl.Int64))
+
+
+def final_rate(
+    packets: pl.DataFrame,
+    source: str = "source",
+    timestamp: str = "timestamp",
+    window_us: int = 1_000_000,
+) -> pl.DataFrame:
+    """rate of every source at its last packet (source | rate)"""
+    return (
+        rolling_rate(packets, source, timestamp, window_us)
+        .group_by(source, maintain_order=True)
+        .agg(pl.col("rate").last())
+    )
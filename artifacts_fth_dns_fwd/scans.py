@@ -0,0 +1,88 @@
+from pathlib import Path
+
+from loguru import logger
+import polars as pl
+
+from artifacts_fth_dns_fwd.config import PROCESSED_DATA_DIR
+from artifacts_fth_dns_fwd.ipset import IPv4Set
+
+DNSSCAN_DIR = PROCESSED_DATA_DIR / "dnsscan"
+
+TFWD = "Transparent Forwarder"
+RESOLVER = "Resolver"
+
+
+def parquet_path(csv_path) -> Path:
+    """udp_dataframe_complete_2025-01-06.csv.gz -> udp_dataframe_complete_2025-01-06.parquet"""
+    csv_path = Path(csv_path)
+    name = csv_path.name.removesuffix(".gz").removesuffix(".csv")
+    return csv_path.with_name(f"{name}.parquet")
+
+
+def scan_source(csv_path) -> Path:
+    """the file scan_dataframe actually reads: the parquet version if it exists, the csv file otherwise"""
+    parquet_file = parquet_path(csv_path)
+    return parquet_file if parquet_file.exists() else Path(csv_path)
+
+
+def scan_dataframe(csv_path) -> pl.LazyFrame:
+    """Lazily scan a dnsscan dataframe.
+
+    The typed parquet version next to the csv file is preferred, filters on response_type and
+    column selections are then pushed down into the parquet reader.
+
+    Args:
+        csv_path: path of the ;-separated csv(.gz) file as written by the scan postprocessing
+
+    Returns:
+        pl.LazyFrame: the scan dataframe
+    """
+    source = scan_source(csv_path)
+    if source.suffix == ".parquet":
+        return pl.scan_parquet(source)
+    logger.warning(
+        f"{parquet_path(csv_path).name} not found, reading {csv_path} instead (convert it with `make data`)"
+    )
+    return pl.scan_csv(csv_path, separator=";", infer_schema_length=100_000)
+
+
+def udp_scan(date: str) -> pl.LazyFrame:
+    """the complete udp scan of the given date (e.g. 2025-01-06) from the dnsscan data"""
+    return scan_dataframe(DNSSCAN_DIR / f"udp_dataframe_complete_{date}.csv.gz")
+
+
+# ---- derived views, all of them stay lazy ----
+
+
+def tfwd(scan: pl.LazyFrame) -> pl.LazyFrame:
+    """transparent forwarders only"""
+    return scan.filter(pl.col("response_type") == TFWD)
+
+
+def non_tfwd(scan: pl.LazyFrame) -> pl.LazyFrame:
+    """resolvers and recursive forwarders"""
+    return scan.filter(pl.col("response_type") != TFWD)
+
+
+def resolvers(scan: pl.LazyFrame) -> pl.LazyFrame:
+    return scan.filter(pl.col("response_type") == RESOLVER)
+
+
+def response_addresses(scan: pl.LazyFrame) -> pl.LazyFrame:
+    """unique response addresses of all non transparent forwarders, these are directly accessible"""
+    return non_tfwd(scan).select("ip_response").unique()
+
+
+def response_address_set(scan: pl.LazyFrame) -> IPv4Set:
+    """the response addresses of all non transparent forwarders as IPv4Set, e.g. to save them for other tools"""
+    return IPv4Set.from_frame(non_tfwd(scan), "ip_response")
+
+
+def shielded_tfwd(scan: pl.LazyFrame) -> pl.LazyFrame:
+    """transparent forwarders whose response address is not directly accessible (i.e. a shielded resolver)"""
+    return tfwd(scan).join(response_addresses(scan), on="ip_response", how="anti")
+
+
+def shielded_resolvers(scan: pl.LazyFrame) -> pl.LazyFrame:
+    """unique addresses of the shielded resolvers themselves"""
+    return shielded_tfwd(scan).select("ip_response").unique()
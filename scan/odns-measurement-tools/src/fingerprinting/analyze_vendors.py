@@ -1,11 +1,20 @@
 import json
 import csv
+import io
 import re
 import sys
 import os
+import sqlite3
+from multiprocessing import Pool
 from tqdm import tqdm
 import argparse
-from common import hash_string
+from common import WorkLedger, hash_string
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 """
 This script analyzes router vendors and models with regex patterns.
@@ -171,222 +180,560 @@ firmware_regexes = [
     r"(lede(?:\s*[vV]?[\d\.]+)?)",
 ]
 
-def find_router_vendor(banner_text):
-    matches = []
-    text_lower = banner_text.lower()
-    for vendor, pattern in vendor_patterns.items():
-        if re.search(pattern, text_lower):
-            if vendor not in matches:
-                matches.append(vendor)
-    return ",".join(matches)
+# literals that every match of the model/firmware regex contains (lowercase), None if there is no such literal
+model_literals = [
+    ("model",),
+    ("model",),
+    ('modelname="',),
+    ('modeldesc="',),
+    ("rb",),
+    ("fritz!box",),
+    ("dvr",),
+    ("nvr",),
+    ("product_name",),
+    ("confightml.js",),
+    ("brother ", "canon ", "hp ", "epson "),
+]
+
+firmware_literals = [
+    ("firmware",),
+    ("firmware ver.",),
+    ("routeros",),
+    None,
+    ("openwrt",),
+    ("wrt",),
+    ("tomato",),
+    ("gargoyle",),
+    ("asuswrt",),
+    ("pfsense",),
+    ("opnsense",),
+    ("lede",),
+]
+
+# (?:^|\s|>)(...)(?:\s|$|<), the form of all vendor and operator patterns
+BOUNDED_PATTERN = re.compile(r"\(\?:\^\|\\s\|>\)(.*)\(\?:\\s\|\$\|<\)")
+
+
+def non_capturing(pattern):
+    """the pattern with all capturing groups turned into non-capturing ones"""
+    return re.sub(r"\\.|\[(?:\\.|[^\]\\])*\]|\((?!\?)",
+                  lambda match: "(?:" if match.group(0) == "(" else match.group(0), pattern)
+
+
+class BoundedPatterns:
+    """
+    Finds the matches of all patterns in one scan of the text.
+    The patterns are combined into one alternation, their delimiting characters are matched by lookarounds
+    instead of being consumed, so a match does not hide the match of another pattern directly next to it
+    (e.g. "cisco zte"). The alternation has no capturing groups, which lets re discard the alternatives
+    quickly; which patterns a matched word belongs to is looked up afterwards (and remembered per word).
+    """
+
+    def __init__(self, patterns, flags=0):
+        bodies = [BOUNDED_PATTERN.fullmatch(pattern).group(1) for pattern in patterns]
+        alternatives = "|".join(non_capturing(body) for body in bodies)
+        self.regex = re.compile(rf"(?:^|(?<=[\s>]))(?:{alternatives})(?=\s|$|<)", flags)
+        self.bodies = [re.compile(body, flags) for body in bodies]
+        self.words = {}
+
+    def word_matches(self, word):
+        if word not in self.words:
+            self.words[word] = [(idx, match) for idx, body in enumerate(self.bodies)
+                                if (match := body.fullmatch(word))]
+        return self.words[word]
+
+    def first_matches(self, text):
+        """index of every matching pattern -> its match (of the pattern body) at its first occurrence"""
+        first = {}
+        for match in self.regex.finditer(text):
+            for idx, body_match in self.word_matches(match.group(0)):
+                first.setdefault(idx, body_match)
+        return first
+
+
+vendor_matcher = BoundedPatterns(vendor_patterns.values())
+operator_matcher = BoundedPatterns(operator_patterns, re.IGNORECASE)
+pid_regex = re.compile(r"PID:\s*([^,\n]+)\b", re.IGNORECASE)
+model_compiled = list(zip([re.compile(pattern, re.IGNORECASE) for pattern in model_regexes], model_literals))
+firmware_compiled = list(zip([re.compile(pattern, re.IGNORECASE) for pattern in firmware_regexes], firmware_literals))
+
+
+def search_prefiltered(compiled, banner_text, text_lower):
+    """
+    first match of every regex, regexes whose literal is not in the text are skipped.
+    The prefilter is only used for ascii text, case-insensitive matching of other characters differs from lower().
+    """
+    prefilter = text_lower.isascii()
+    for regex, literals in compiled:
+        if prefilter and literals is not None and not any(literal in text_lower for literal in literals):
+            continue
+        match = regex.search(banner_text)
+        if match:
+            yield match
+
 
-def find_model_version(banner_text):
+def find_router_vendor(banner_text, text_lower=None):
+    text_lower = banner_text.lower() if text_lower is None else text_lower
+    # one scan for all vendors, the output keeps the order of vendor_patterns
+    found = vendor_matcher.first_matches(text_lower)
+    return ",".join(vendor for idx, vendor in enumerate(vendor_patterns) if idx in found)
+
+def find_model_version(banner_text, text_lower=None):
     if "PID:" in banner_text:
-        match = re.search(r"PID:\s*([^,\n]+)\b", banner_text, re.IGNORECASE)
+        match = pid_regex.search(banner_text)
         if match:
             return match.group(1).strip()
     
+    text_lower = banner_text.lower() if text_lower is None else text_lower
     matches = []
-    for pattern in model_regexes:
-        match = re.search(pattern, banner_text, re.IGNORECASE)
-        if match:
-            modelv = match.group(1).strip()
-            if modelv == "=": continue
-            if modelv not in matches:
-                matches.append(modelv)
+    for match in search_prefiltered(model_compiled, banner_text, text_lower):
+        modelv = match.group(1).strip()
+        if modelv == "=": continue
+        if modelv not in matches:
+            matches.append(modelv)
     return ",".join(matches)
 
-def find_firmware_version(banner_text):
+def find_firmware_version(banner_text, text_lower=None):
+    text_lower = banner_text.lower() if text_lower is None else text_lower
     matches = []
-    for pattern in firmware_regexes:
-        match = re.search(pattern, banner_text, re.IGNORECASE)
-        if match:
-            version = match.group(1).strip()
-            if ".cgi" in version:
-                print(match)
-                input()
-            if version not in matches:
-                matches.append(version)
+    for match in search_prefiltered(firmware_compiled, banner_text, text_lower):
+        version = match.group(1).strip()
+        if ".cgi" in version: continue  # a script path, not a version
+        if version not in matches:
+            matches.append(version)
     return ",".join(matches)
 
-def find_network_operator(banner_text):
+def find_network_operator(banner_text, text_lower=None):
+    text_lower = banner_text.lower() if text_lower is None else text_lower
+    # first occurrence of every operator in one scan, in the order of operator_patterns
+    first = operator_matcher.first_matches(text_lower)
     matches = []
-    text_lower = banner_text.lower()
-    for op_pattern in operator_patterns:
-        match = re.search(op_pattern, text_lower, re.IGNORECASE)
-        if match:
-            operator = match.group(1).strip()
-            if operator not in matches:
-                matches.append(operator)
+    for idx in sorted(first):
+        operator = first[idx].group(1).strip()
+        if operator not in matches:
+            matches.append(operator)
     return ",".join(matches)
 
-def analyze_str(ip_address, banner_content, successful_protocols):
+# bump when the analysis itself changes, changes of the pattern tables invalidate the cache on their own
+BANNER_CACHE_VERSION = 2
+BANNER_CACHE_PATH = "banner_cache.sqlite"
+
+
+def patterns_fingerprint():
+    """hash of everything the results of a banner depend on"""
+    return hash_string(repr((BANNER_CACHE_VERSION, vendor_patterns, operator_patterns, model_regexes,
+                             firmware_regexes, model_literals, firmware_literals)))
+
+
+class BannerCache:
+    """
+    Persistent banner hash -> (operator, vendor, model, firmware) mapping in sqlite.
+    Many devices return identical banners, a known banner costs a lookup instead of all regexes.
+    The cache is cleared when it was filled with other pattern tables. New results are kept in memory
+    and written in one transaction by flush, so parallel workers hold the write lock only briefly.
+    """
+
+    def __init__(self, path=BANNER_CACHE_PATH):
+        self.db = sqlite3.connect(path, timeout=300)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS banners (kind TEXT, hash TEXT, operator TEXT, vendor TEXT, "
+                        "model TEXT, firmware TEXT, PRIMARY KEY (kind, hash))")
+        fingerprint = patterns_fingerprint()
+        with self.db:
+            stored = self.db.execute("SELECT value FROM meta WHERE key = 'patterns'").fetchone()
+            if stored is None or stored[0] != fingerprint:
+                self.db.execute("DELETE FROM banners")
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('patterns', ?)", (fingerprint,))
+        self.pending = {}
+
+    def lookup(self, kind, banner_hash, analyze, banner_content):
+        """cached result of the banner, analyze(banner_content) if it is not known yet"""
+        key = (kind, banner_hash)
+        if key in self.pending:
+            return self.pending[key]
+        cached = self.db.execute("SELECT operator, vendor, model, firmware FROM banners WHERE kind = ? AND hash = ?",
+                                 key).fetchone()
+        if cached is not None:
+            return cached
+        self.pending[key] = result = analyze(banner_content)
+        return result
+
+    def flush(self):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO banners VALUES (?, ?, ?, ?, ?, ?)",
+                                (key + result for key, result in self.pending.items()))
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+# cache of this process, see open_banner_cache
+banner_cache = None
+
+
+def open_banner_cache(path):
+    """opens the cache used by analyze_str and analyze_str_snmp in this process (also the pool initializer)"""
+    global banner_cache
+    banner_cache = BannerCache(path) if path else None
+
+
+def close_banner_cache():
+    global banner_cache
+    if banner_cache is not None:
+        banner_cache.close()
+        banner_cache = None
+
+
+def analyze_banner(banner_content):
+    """(operator, vendor, model, firmware) of a web or ssh banner"""
     # grab device characteristics with regex
-    router_vendor = find_router_vendor(banner_content)
-    model_version = find_model_version(banner_content)
-    firmware_version = find_firmware_version(banner_content)
-    network_operator = find_network_operator(banner_content)
+    text_lower = banner_content.lower()
+    router_vendor = find_router_vendor(banner_content, text_lower)
+    model_version = find_model_version(banner_content, text_lower)
+    firmware_version = find_firmware_version(banner_content, text_lower)
+    network_operator = find_network_operator(banner_content, text_lower)
 
     if router_vendor == "" and "NVR" in model_version:
         router_vendor = "UNV"
 
-    row = {
-        headers[0]: ip_address,
-        headers[1]: network_operator,
-        headers[2]: router_vendor,
-        headers[3]: model_version,
-        headers[4]: firmware_version,
-        headers[5]: ",".join(successful_protocols),
-        headers[6]: hash_string(banner_content)
-    }
-
-    return row
+    return network_operator, router_vendor, model_version, firmware_version
 
-def analyze_str_snmp(ip_address, banner_content):
+def analyze_banner_snmp(banner_content):
+    """(operator, vendor, model, firmware) of a snmp sysDescr"""
     # grab device characteristics with regex
-    router_vendor = find_router_vendor(banner_content)
+    text_lower = banner_content.lower()
+    router_vendor = find_router_vendor(banner_content, text_lower)
     if "RouterOS" in banner_content:
         split_model = banner_content.split(" ", 1)
         if len(split_model) == 2:
             model_version = split_model[1]
     else:
-        model_version = find_model_version(banner_content)
+        model_version = find_model_version(banner_content, text_lower)
         if model_version == "":
             model_version = banner_content.replace(",", "").replace(";", "")
-    firmware_version = find_firmware_version(banner_content)
-    network_operator = find_network_operator(banner_content)
+    firmware_version = find_firmware_version(banner_content, text_lower)
+    network_operator = find_network_operator(banner_content, text_lower)
 
     if router_vendor == "" and "NVR" in model_version:
         router_vendor = "UNV"
 
+    return network_operator, router_vendor, model_version, firmware_version
+
+def analyze_cached(kind, banner_hash, analyze, banner_content):
+    if banner_cache is None:
+        return analyze(banner_content)
+    return banner_cache.lookup(kind, banner_hash, analyze, banner_content)
+
+def analyze_str(ip_address, banner_content, successful_protocols):
+    banner_hash = hash_string(banner_content)
+    network_operator, router_vendor, model_version, firmware_version = \
+        analyze_cached("banner", banner_hash, analyze_banner, banner_content)
+
     row = {
         headers[0]: ip_address,
         headers[1]: network_operator,
         headers[2]: router_vendor,
         headers[3]: model_version,
         headers[4]: firmware_version,
-        headers[5]: "snmp",
-        headers[6]: hash_string(banner_content)
+        headers[5]: ",".join(successful_protocols),
+        headers[6]: banner_hash
     }
 
     return row
 
-def parse_html_output(input_html_path, output_csv_path):
-    with open(output_csv_path, "w", newline="", encoding="utf-8") as outfile:
-        writer = csv.DictWriter(outfile, fieldnames=headers, delimiter=";")
-        writer.writeheader()
-        for filename in tqdm(os.listdir(input_html_path)):
-            filepath = os.path.join(input_html_path, filename)
-            if os.path.isfile(filepath):
-                with open(filepath, "r") as file:
-                    file_content = file.read()
-                    row = analyze_str(filename[:-5],file_content,"")
-                    writer.writerow(row)
-    print(f"CSV output written to: {output_csv_path}")
+def analyze_str_snmp(ip_address, banner_content):
+    banner_hash = hash_string(banner_content)
+    network_operator, router_vendor, model_version, firmware_version = \
+        analyze_cached("snmp", banner_hash, analyze_banner_snmp, banner_content)
 
-def parse_zgrab_output(input_json_path, output_csv_path):
-    with open(input_json_path, "r", encoding="utf-8") as infile:
-        total_lines = sum(1 for _ in infile)
+    row = {
+        headers[0]: ip_address,
+        headers[1]: network_operator,
+        headers[2]: router_vendor,
+        headers[3]: model_version,
+        headers[4]: firmware_version,
+        headers[5]: "snmp",
+        headers[6]: banner_hash
+    }
 
-    with open(input_json_path, "r", encoding="utf-8") as infile, \
-         open(output_csv_path, "w", newline="", encoding="utf-8") as outfile:
+    return row
 
-        writer = csv.DictWriter(outfile, fieldnames=headers, delimiter=";")
-        writer.writeheader()
+LEDGER_PATH = "analyze_ledger.sqlite"
+
+
+def run_key(mode, input_path, output_path):
+    """identifies a run in the ledger, a changed input starts a new run"""
+    stat = os.stat(input_path)
+    return f"{mode};{os.path.abspath(input_path)};{stat.st_size};{stat.st_mtime_ns};{os.path.abspath(output_path)}"
+
+class ResumableOutput:
+    """
+    csv output of a run that can be continued after an interruption.
+    After every written block the position in the input and the size of the output are recorded in the ledger,
+    a resumed run truncates the output to the recorded size and continues at the recorded position of the input.
+    """
+
+    def __init__(self, output_csv_path, ledger_path=None, key=None, resume=False):
+        self.ledger = WorkLedger(ledger_path) if ledger_path else None
+        self.key = key
+        checkpoint = self.ledger.outcome(key) if self.ledger is not None and resume else None
+        if checkpoint is not None and os.path.isfile(output_csv_path):
+            self.position, size = map(int, checkpoint.split(";"))
+            self.file = open(output_csv_path, "r+b")
+            self.file.truncate(size)
+            self.file.seek(size)
+            print(f"resuming at input position {self.position}")
+        else:
+            self.position = 0
+            self.file = open(output_csv_path, "wb")
+            header = io.StringIO()
+            csv.DictWriter(header, fieldnames=headers, delimiter=";").writeheader()
+            self.write(header.getvalue(), 0)
+
+    def write(self, rows, position):
+        """appends the rows of the input up to position"""
+        self.file.write(rows.encode("utf-8"))
+        self.file.flush()
+        self.position = position
+        if self.ledger is not None:
+            self.ledger.record(self.key, f"{position};{self.file.tell()}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+        if self.ledger is not None:
+            self.ledger.close()
+
+# html files analyzed between two checkpoints
+HTML_BATCH_SIZE = 1000
+
+
+def analyze_html_files(input_html_path, filenames):
+    rows = io.StringIO()
+    writer = csv.DictWriter(rows, fieldnames=headers, delimiter=";")
+    for filename in filenames:
+        filepath = os.path.join(input_html_path, filename)
+        if os.path.isfile(filepath):
+            with open(filepath, "r") as file:
+                file_content = file.read()
+                row = analyze_str(filename[:-5],file_content,"")
+                writer.writerow(row)
+    return rows.getvalue()
+
+def parse_html_output(input_html_path, output_csv_path, cache_path=None, ledger_path=None, resume=False):
+    """the html files are analyzed in the order of their names, a resumed run skips the files of the checkpoint"""
+    filenames = sorted(os.listdir(input_html_path))
+    key = run_key("selenium", input_html_path, output_csv_path)
+    open_banner_cache(cache_path)
+    with ResumableOutput(output_csv_path, ledger_path, key, resume) as output, \
+         tqdm(total=len(filenames), initial=output.position) as pbar:
+        for start in range(output.position, len(filenames), HTML_BATCH_SIZE):
+            batch = filenames[start:start + HTML_BATCH_SIZE]
+            output.write(analyze_html_files(input_html_path, batch), start + len(batch))
+            pbar.update(len(batch))
+    close_banner_cache()
+    print(f"CSV output written to: {output_csv_path}")
 
-        for line in tqdm(infile, total=total_lines):
+# bytes of the zgrab output a worker analyzes at once
+ZGRAB_CHUNK_SIZE = 8 << 20
+
+
+def analyze_zgrab_record(record):
+    # extract ip or domain
+    ip_address = record.get("ip") or record.get("domain") or ""
+
+    # data_section typically holds sub-results for each configured probe
+    data_section = record.get("data", {})
+
+    successful_protocols = []
+    combined_banners = []
+
+    # HTTP 80
+    http80_data = data_section.get("http80")
+    if http80_data and http80_data.get("status","") != "connection-timeout":
+        successful_protocols.append("http80")
+        body_text = (http80_data["result"]
+                                .get("response", {})
+                                .get("body", ""))
+        if body_text:
+            combined_banners.append(body_text)
+
+    # HTTP 8080
+    http8080_data = data_section.get("http8080")
+    if http8080_data and http8080_data.get("status","") != "connection-timeout":
+        successful_protocols.append("http8080")
+        body_text = (http8080_data["result"]
+                                 .get("response", {})
+                                 .get("body", ""))
+        if body_text:
+            combined_banners.append(body_text)
+
+    # HTTPS 443
+    https443_data = data_section.get("https443")
+    if https443_data and https443_data.get("status","") != "connection-timeout":
+        successful_protocols.append("https443")
+        body_text = (https443_data["result"]
+                                 .get("response", {})
+                                 .get("body", ""))
+        if body_text:
+            combined_banners.append(body_text)
+
+    # SSH
+    ssh_data = data_section.get("ssh")
+    if ssh_data and ssh_data.get("status","") != "connection-timeout":
+        successful_protocols.append("ssh")
+        banner = ssh_data["result"].get("metadata", {}).get("banner", "")
+        if banner:
+            combined_banners.append(banner)
+        server_id = ssh_data["result"].get("server_id", {}).get("software","")
+        if server_id:
+            combined_banners.append(server_id)
+
+    # combine banner text
+    big_banner_text = "\n".join(combined_banners)
+
+    return analyze_str(ip_address, big_banner_text, successful_protocols)
+
+def zgrab_chunks(input_json_path, chunk_size, start=0):
+    """(start, end) byte ranges of the file from start on, every range ends after a line break (or at the end of the file)"""
+    size = os.path.getsize(input_json_path)
+    with open(input_json_path, "rb") as infile:
+        while start < size:
+            infile.seek(min(start + chunk_size, size))
+            infile.readline()
+            end = min(infile.tell(), size)
+            yield start, end
+            start = end
+
+def analyze_zgrab_chunk(args):
+    """csv rows of all records in the byte range of the zgrab output and the number of bytes read"""
+    input_json_path, start, end = args
+    rows = io.StringIO()
+    writer = csv.DictWriter(rows, fieldnames=headers, delimiter=";")
+    with open(input_json_path, "rb") as infile:
+        infile.seek(start)
+        for line in infile.read(end - start).splitlines():
             try:
-                record = json.loads(line)
-            except json.JSONDecodeError:
+                record = json_loads(line)
+            except ValueError:
                 continue
-
-            # extract ip or domain
-            ip_address = record.get("ip") or record.get("domain") or ""
-
-            # data_section typically holds sub-results for each configured probe
-            data_section = record.get("data", {})
-
-            successful_protocols = []
-            combined_banners = []
-
-            # HTTP 80
-            http80_data = data_section.get("http80")
-            if http80_data and http80_data.get("status","") != "connection-timeout":
-                successful_protocols.append("http80")
-                body_text = (http80_data["result"]
-                                        .get("response", {})
-                                        .get("body", ""))
-                if body_text:
-                    combined_banners.append(body_text)
-
-            # HTTP 8080
-            http8080_data = data_section.get("http8080")
-            if http8080_data and http8080_data.get("status","") != "connection-timeout":
-                successful_protocols.append("http8080")
-                body_text = (http8080_data["result"]
-                                         .get("response", {})
-                                         .get("body", ""))
-                if body_text:
-                    combined_banners.append(body_text)
-
-            # HTTPS 443
-            https443_data = data_section.get("https443")
-            if https443_data and https443_data.get("status","") != "connection-timeout":
-                successful_protocols.append("https443")
-                body_text = (https443_data["result"]
-                                         .get("response", {})
-                                         .get("body", ""))
-                if body_text:
-                    combined_banners.append(body_text)
-
-            # SSH
-            ssh_data = data_section.get("ssh")
-            if ssh_data and ssh_data.get("status","") != "connection-timeout":
-                successful_protocols.append("ssh")
-                banner = ssh_data["result"].get("metadata", {}).get("banner", "")
-                if banner:
-                    combined_banners.append(banner)
-                server_id = ssh_data["result"].get("server_id", {}).get("software","")
-                if server_id:
-                    combined_banners.append(server_id)
-
-            # combine banner text
-            big_banner_text = "\n".join(combined_banners)
-
-            row = analyze_str(ip_address, big_banner_text, successful_protocols)
-
-            writer.writerow(row)
+            writer.writerow(analyze_zgrab_record(record))
+    if banner_cache is not None:
+        banner_cache.flush()
+    return rows.getvalue(), end - start
+
+def parse_zgrab_output(input_json_path, output_csv_path, workers=1, progress=True, chunk_size=ZGRAB_CHUNK_SIZE,
+                       cache_path=None, ledger_path=None, resume=False):
+    """
+    The zgrab output is split into byte ranges at line breaks that are analyzed by separate processes,
+    the rows are written in the order of the input. Every process opens the banner cache on its own.
+    The checkpoints are the byte offsets of the input, a resumed run continues after the last written range.
+    """
+    key = run_key("zgrab", input_json_path, output_csv_path)
+    with ResumableOutput(output_csv_path, ledger_path, key, resume) as output, \
+         tqdm(total=os.path.getsize(input_json_path), initial=output.position, unit="B", unit_scale=True,
+              disable=not progress) as pbar:
+
+        chunks = [(input_json_path, start, end)
+                  for start, end in zgrab_chunks(input_json_path, chunk_size, output.position)]
+
+        if workers > 1:
+            with Pool(workers, initializer=open_banner_cache, initargs=(cache_path,)) as pool:
+                for rows, size in pool.imap(analyze_zgrab_chunk, chunks):
+                    output.write(rows, output.position + size)
+                    pbar.update(size)
+        else:
+            open_banner_cache(cache_path)
+            try:
+                for rows, size in map(analyze_zgrab_chunk, chunks):
+                    output.write(rows, output.position + size)
+                    pbar.update(size)
+            finally:
+                close_banner_cache()
 
     print(f"CSV output written to: {output_csv_path}")
 
-def parse_onesixtyone_output(inpath, outpath):
-    with open(inpath, "r", encoding="utf-8") as infile:
-        total_lines = sum(1 for _ in infile)
-
+# <ip> [<community>] <sysDescr> lines of onesixtyone
+ONESIXTYONE_LINE = re.compile(r"^(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) \[[^\]]+\] (.+)$", re.IGNORECASE)
+# hosts a worker analyzes at once
+SNMP_BATCH_SIZE = 10_000
+
+
+def onesixtyone_batches(infile, pbar, skip_lines=0, batch_size=SNMP_BATCH_SIZE):
+    """
+    batches of (ip, sysDescr) of the first answer of every host and the number of lines read up to the end of the
+    batch, the file is read once line by line. The hosts of the first skip_lines lines (written by an interrupted run)
+    are only remembered as seen.
+    """
+    seen = set()
+    batch = []
+    lines = 0
+    for lines, line in enumerate(infile, 1):
+        pbar.update(len(line.encode("utf-8")))
+        match = ONESIXTYONE_LINE.search(line)
+        if match:
+            ip = match.group(1).strip()
+            if ip in seen: continue
+            seen.add(ip)
+            if lines <= skip_lines: continue
+            batch.append((ip, match.group(2).strip()))
+            if len(batch) == batch_size:
+                yield batch, lines
+                batch = []
+    if batch:
+        yield batch, lines
+
+def analyze_snmp_batch(args):
+    """csv rows of a batch of (ip, sysDescr) and the input position of the batch"""
+    hosts, position = args
+    rows = io.StringIO()
+    writer = csv.DictWriter(rows, fieldnames=headers, delimiter=";")
+    for ip, snmp_desc in hosts:
+        writer.writerow(analyze_str_snmp(ip, snmp_desc))
+    if banner_cache is not None:
+        banner_cache.flush()
+    return rows.getvalue(), position
+
+def parse_onesixtyone_output(inpath, outpath, cache_path=None, workers=1, progress=True, ledger_path=None, resume=False):
+    """
+    The onesixtyone output is streamed, every host is analyzed once (its first answer),
+    batches of hosts are analyzed by separate processes and written in the order of the input.
+    The checkpoints are the numbers of lines read, a resumed run continues after the last written batch.
+    """
+    key = run_key("snmp", inpath, outpath)
     with open(inpath, "r", encoding="utf-8") as infile, \
-         open(outpath, "w", newline="", encoding="utf-8") as outfile:
-
-        writer = csv.DictWriter(outfile, fieldnames=headers, delimiter=";")
-        writer.writeheader()
-
-        ips = []
-
-        for line in tqdm(infile, total=total_lines):
-            match = re.search(r"^(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) \[[^\]]+\] (.+)$", line, re.IGNORECASE)
-            if match:
-                ip = match.group(1).strip()
-                if ip in ips: continue
-                ips.append(ip)
-                snmp_desc = match.group(2).strip()
-                row = analyze_str_snmp(ip, snmp_desc)
-                writer.writerow(row)
+         ResumableOutput(outpath, ledger_path, key, resume) as output, \
+         tqdm(total=os.path.getsize(inpath), unit="B", unit_scale=True, disable=not progress) as pbar:
+
+        hosts = onesixtyone_batches(infile, pbar, output.position)
+        if workers > 1:
+            with Pool(workers, initializer=open_banner_cache, initargs=(cache_path,)) as pool:
+                for rows, position in pool.imap(analyze_snmp_batch, hosts):
+                    output.write(rows, position)
+        else:
+            open_banner_cache(cache_path)
+            try:
+                for rows, position in map(analyze_snmp_batch, hosts):
+                    output.write(rows, position)
+            finally:
+                close_banner_cache()
     print(f"CSV output written to: {outpath}")
 
-
 if __name__ == "__main__":
     parser.add_argument("-m", "--mode", type=str, help="zgrab, selenium, snmp")
     parser.add_argument("-i", "--input", type=str, help="path to input file/folder")
     parser.add_argument("-o", "--output", type=str, help="path to output file")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="processes analyzing the zgrab or snmp output")
+    parser.add_argument("--no-progress", action="store_true", help="do not show a progress bar")
+    parser.add_argument("--cache", type=str, default=BANNER_CACHE_PATH, help="sqlite cache of analyzed banners")
+    parser.add_argument("--no-cache", action="store_true", help="analyze every banner, do not use the cache")
+    parser.add_argument("--ledger", type=str, default=LEDGER_PATH, help="sqlite ledger of the progress of all runs")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run of the same input and output")
     args, leftovers = parser.parse_known_args()
     if args.mode is None :
         print("mode missing --mode")
@@ -394,10 +741,15 @@ if __name__ == "__main__":
     if args.input is None:
         print("input path missing --input")
         sys.exit(1)
+    cache_path = None if args.no_cache else args.cache
 
     if args.mode == "selenium": 
-        parse_html_output(args.input, args.output if args.output is not None else "parsed_results_html.csv")
+        parse_html_output(args.input, args.output if args.output is not None else "parsed_results_html.csv", cache_path,
+                          args.ledger, args.resume)
     elif args.mode == "zgrab":
-        parse_zgrab_output(args.input, args.output if args.output is not None else "parsed_results.csv")
+        parse_zgrab_output(args.input, args.output if args.output is not None else "parsed_results.csv",
+                           args.workers, not args.no_progress, cache_path=cache_path, ledger_path=args.ledger,
+                           resume=args.resume)
     elif args.mode == "snmp":
-        parse_onesixtyone_output(args.input, args.output if args.output is not None else "parsed_results_snmp.csv")
+        parse_onesixtyone_output(args.input, args.output if args.output is not None else "parsed_results_snmp.csv",
+                                 cache_path, args.workers, not args.no_progress, args.ledger, args.resume)
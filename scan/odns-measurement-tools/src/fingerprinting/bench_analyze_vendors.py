@@ -0,0 +1,133 @@
+"""
+Benchmark: vendor/operator/model/firmware matching of analyze_vendors.py
+compares the former one re.search per pattern with the combined regexes and prefiltered searches
+on synthetic banners and checks that both produce identical output
+
+call like this: python bench_analyze_vendors.py [number of banners]
+"""
+import random
+import re
+import sys
+import time
+
+import analyze_vendors
+from analyze_vendors import firmware_regexes, model_regexes, operator_patterns, vendor_patterns
+
+
+# the former implementation of analyze_vendors.py
+def reference_router_vendor(banner_text):
+    matches = []
+    text_lower = banner_text.lower()
+    for vendor, pattern in vendor_patterns.items():
+        if re.search(pattern, text_lower):
+            if vendor not in matches:
+                matches.append(vendor)
+    return ",".join(matches)
+
+
+def reference_model_version(banner_text):
+    if "PID:" in banner_text:
+        match = re.search(r"PID:\s*([^,\n]+)\b", banner_text, re.IGNORECASE)
+        if match:
+            return match.group(1).strip()
+    matches = []
+    for pattern in model_regexes:
+        match = re.search(pattern, banner_text, re.IGNORECASE)
+        if match:
+            modelv = match.group(1).strip()
+            if modelv == "=": continue
+            if modelv not in matches:
+                matches.append(modelv)
+    return ",".join(matches)
+
+
+def reference_firmware_version(banner_text):
+    matches = []
+    for pattern in firmware_regexes:
+        match = re.search(pattern, banner_text, re.IGNORECASE)
+        if match:
+            version = match.group(1).strip()
+            if ".cgi" in version: continue
+            if version not in matches:
+                matches.append(version)
+    return ",".join(matches)
+
+
+def reference_network_operator(banner_text):
+    matches = []
+    text_lower = banner_text.lower()
+    for op_pattern in operator_patterns:
+        match = re.search(op_pattern, text_lower, re.IGNORECASE)
+        if match:
+            operator = match.group(1).strip()
+            if operator not in matches:
+                matches.append(operator)
+    return ",".join(matches)
+
+
+def reference(banner_text):
+    return (reference_router_vendor(banner_text), reference_model_version(banner_text),
+            reference_firmware_version(banner_text), reference_network_operator(banner_text))
+
+
+def combined(banner_text):
+    text_lower = banner_text.lower()
+    return (analyze_vendors.find_router_vendor(banner_text, text_lower),
+            analyze_vendors.find_model_version(banner_text, text_lower),
+            analyze_vendors.find_firmware_version(banner_text, text_lower),
+            analyze_vendors.find_network_operator(banner_text, text_lower))
+
+
+KEYWORDS = [
+    "3com", "Actiontec", "ADTRAN", "alcatel-lucent", "Alcatel Lucent", "arcadyan", "ARRIS", "aruba", "asus", "Asustor",
+    "AVM", "FRITZ!Box 7490", "fritz box", "fritzbox", "cisco", "IOS XR", "ios-xe", "D-Link", "dlink", "d_link", "DrayTek",
+    "fortigate", "Huawei", "junos", "Juniper", "linksys", "MikroTik", "RouterOS 6.45.1", "routeros", "netgear",
+    "OpenWrt Chaos Calmer 15.05", "openwrt", "pace", "TP-Link", "tplink", "tp link", "ubiquiti", "EdgeOS", "unifi", "ZTE",
+    "zyxel", "Synology", "QNAP", "western digital", "WD", "samsung", "LG", "ge appliances", "sony", "TCL", "tivo",
+    "Hikvision", "Dahua", "HP", "HP LaserJet Pro M404", "Canon", "Canon MF644Cdw", "Brother HL-L2350DW", "Epson",
+    "Verizon", "AT&T", "at & t", "Comcast", "Telekom", "Vodafone", "telia", "sprint", "tmobile", "china telecom",
+    "China Unicom", "bt group", "orange", "bell canada", "rogers", "shaw", "cox communications", "Model: AX3000",
+    "model RT-AC68U", 'modelName="Archer C7"', 'modelDesc="Wireless Router"', "RB2011", "RB750Gr3", "dvr", "DVR",
+    "NVR301-16S3", '<li id="product_name">HG255s</li>', "<li class='x' id='product_name'>F@ST 5366</li>",
+    "src='/configHtml.js?v=WOM MiMo 2'", "Firmware Version 1.2.3", "firmware: 2.0.1b", "Firmware Ver.3.1.4",
+    "/firmware 1.0", "firmware 1.0/upgrade.cgi", "v1.2.3", "V2.10", "dd-wrt v3.0", "DD WRT", "tomato 1.28", "Gargoyle 1.12",
+    "Asuswrt-Merlin 384.19", "pfSense 2.4.5", "OPNsense 20.7", "LEDE 17.01", "PID: ISR4331/K9, VID: V04",
+    "Kelvin K", "ſhaw", "İnternet", "ıntel", "café", "model =", "Model: =",
+]
+FILLER = ["the", "router", "login", "admin", "web", "interface", "device", "status", "home", "gateway", "index.html",
+          "copyright", "2024", "all", "rights", "reserved", "<html>", "</html>", "<title>", "</title>", "<div>",
+          "</div>", "<script>", "var", "x", "=", "1;", "</script>"]
+SEPARATORS = [" ", " ", " ", "\n", "<", ">", "\t", "-", "/", ""]
+
+
+def banners(n: int):
+    rnd = random.Random(0)
+    for _ in range(n):
+        words = []
+        for _ in range(rnd.randrange(5, 400)):
+            words.append(rnd.choice(KEYWORDS) if rnd.random() < 0.05 else rnd.choice(FILLER))
+            words.append(rnd.choice(SEPARATORS))
+        yield "".join(words)
+
+
+def measure(fn, texts):
+    start_t = time.perf_counter()
+    results = [fn(text) for text in texts]
+    return results, time.perf_counter() - start_t
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    texts = list(banners(n))
+    # every keyword on its own and every pair of keywords next to each other
+    texts += KEYWORDS + [f"{a}{sep}{b}" for a in KEYWORDS for b in KEYWORDS for sep in (" ", "<", ">")]
+    print(f"{len(texts)} banners, {sum(map(len, texts)) / 2**20:.1f} MiB")
+    expected, took_reference = measure(reference, texts)
+    print(f"{'re.search per pattern':>22}: {took_reference:.2f}s")
+    results, took_combined = measure(combined, texts)
+    print(f"{'combined regexes':>22}: {took_combined:.2f}s ({took_reference / took_combined:.1f}x)")
+    differences = [(text, a, b) for text, a, b in zip(texts, expected, results) if a != b]
+    for text, a, b in differences[:10]:
+        print(f"difference for {text!r}:\n  expected {a}\n  got      {b}")
+    print("identical output" if not differences else f"{len(differences)} banners differ")
+    sys.exit(1 if differences else 0)
@@ -1,62 +1,197 @@
+"""
+Merges the results of analyze_vendors.py (zgrab, selenium, snmp) into combined_results.csv and dealiases them.
+
+Every input is sorted by IP in runs of bounded size that are spilled to temporary files (external sort),
+the runs of all inputs are then merged (k-way merge) and the rows of an IP are combined while streaming:
+the values of every column are unioned and the banner-hash is computed from the union of all banner hashes.
+Only one run is in memory at a time, the merge keeps one row per run.
+
+The dealiasing counts the IPs of every device (vendor, model, protocols, banner) per network, for several prefix
+lengths and the BGP prefixes of the enriched results at once: the IPs are parsed into uint32 values, the networks are
+integer keys computed from them and all granularities are counted in a single group_by.
+
+call like this: python combine_results.py parsed_results.csv parsed_results_html.csv parsed_results_snmp.csv
+with BGP prefixes: python combine_results.py ... --enriched fingerprinting_results-enriched.csv
+"""
 import os
-import sys
 import csv
-from collections import defaultdict
+import argparse
+import heapq
+import ipaddress
+import itertools
+import sys
+import tempfile
+import polars as pl
 from common import hash_string
 
+# the IPv4 helpers are shared with the rate limit scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ratelimit"))
+from intersect import ipv4_to_uint32, uint32_to_ipv4  # noqa: E402
+
 headers = [
-    "ip", 
-    "network-operator", 
-    "router-vendor", 
-    "model-version", 
-    "firmware-version", 
+    "ip",
+    "network-operator",
+    "router-vendor",
+    "model-version",
+    "firmware-version",
     "successful-protocols",
     "banner-hash",
 ]
 
-if len(sys.argv) > 2:
-    # merged data
-    data = defaultdict(lambda: defaultdict(set))
+# rows of an input that are sorted in memory at once
+ROWS_PER_RUN = 1_000_000
+
+# networks the devices are dealiased in, the BGP prefixes are added if the enriched results are given
+PREFIX_LENGTHS = (24, 20, 16)
+# the IPs of a network with equal values in these columns are counted as one device
+DEVICE_COLUMNS = ["router-vendor", "model-version", "successful-protocols", "banner-hash"]
 
-    # read csv and merge into dataframe
-    def read_csv_to_dict(filename):
+
+def ip_key(ip):
+    """IPv4 addresses sort as integers, anything else (e.g. domains) after them as string"""
+    try:
+        return 0, int(ipaddress.IPv4Address(ip)), ""
+    except ValueError:
+        return 1, 0, ip
+
+
+def input_columns(filenames):
+    """all columns of the inputs in the order of their first appearance, the IP column first"""
+    columns = [headers[0]]
+    for filename in filenames:
         with open(filename, newline="", encoding="utf-8") as f:
-            reader = csv.reader(f, delimiter=";")
-            headers = next(reader)  # column header
-            for row in reader:
-                id_key = row[0]  # first column is key (=IP)
-                for col_index in range(1, len(headers)):  # iterate remaining rows
-                    column_name = headers[col_index]
-                    values = row[col_index].split(",")  # split on comma
-                    data[id_key][column_name].update(values)  # merge unique values
-                    if "" in  data[id_key][column_name] and len(data[id_key][column_name]) > 1:
-                        data[id_key][column_name].remove("")
-
-    for file_arg in sys.argv[1:]:
-        read_csv_to_dict(file_arg)
-
-    all_columns = [headers[0]] + list(next(iter(data.values())).keys())
-
-    # write back
-    with open("combined_results.csv", "w", newline="", encoding="utf-8") as f:
+            for column in next(csv.reader(f, delimiter=";"))[1:]:
+                if column not in columns:
+                    columns.append(column)
+    return columns
+
+
+def sorted_runs(filename, columns, tmp_dir, rows_per_run=ROWS_PER_RUN):
+    """sorts the rows of the input by IP in runs of rows_per_run rows, returns the paths of the spilled runs"""
+    runs = []
+    with open(filename, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=";")
+        file_columns = next(reader)
+        # the rows of every input are brought into the layout of the combined columns
+        positions = [file_columns.index(column) if column in file_columns else None for column in columns]
+        while True:
+            rows = [[row[pos] if pos is not None else "" for pos in positions]
+                    for row in itertools.islice(reader, rows_per_run)]
+            if not rows:
+                return runs
+            rows.sort(key=lambda row: ip_key(row[0]))
+            run_path = os.path.join(tmp_dir, f"run-{len(os.listdir(tmp_dir))}.csv")
+            with open(run_path, "w", newline="", encoding="utf-8") as run:
+                csv.writer(run, delimiter=";").writerows(rows)
+            runs.append(run_path)
+
+
+def read_run(run_path):
+    with open(run_path, newline="", encoding="utf-8") as run:
+        yield from csv.reader(run, delimiter=";")
+
+
+def combine_rows(ip, rows, columns):
+    """one row of all rows of the IP: the unique values of every column, empty values only if there is no other"""
+    combined = [ip]
+    for col_index, column in enumerate(columns[1:], 1):
+        values = set()
+        for row in rows:
+            values.update(row[col_index].split(","))  # split on comma
+        if "" in values and len(values) > 1:
+            values.remove("")
+        if "hash" in column:
+            combined.append(hash_string(",".join(sorted(values))))
+        else:
+            combined.append(",".join(sorted(values)))  # merge all unique
+    return combined
+
+
+def combine_results(filenames, output_filename="combined_results.csv", rows_per_run=ROWS_PER_RUN, tmp_dir=None):
+    """external sort of every input by IP and a k-way merge of all runs into output_filename, ordered by IP"""
+    columns = input_columns(filenames)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as spill_dir, \
+         open(output_filename, "w", newline="", encoding="utf-8") as f:
+        runs = [run for filename in filenames for run in sorted_runs(filename, columns, spill_dir, rows_per_run)]
         writer = csv.writer(f, delimiter=";")
-        writer.writerow(all_columns)  # headers
-        
-        for id_key in sorted(data.keys()):
-            row = [id_key] # write key column
-            for column in all_columns[1:]:  # write remainin
-                if "hash" in column:
-                    row.append(hash_string(",".join(sorted(data[id_key].get(column, set())))))
-                else:
-                    row.append(",".join(sorted(data[id_key].get(column, set()))))  # merge all unique
-            writer.writerow(row)
+        writer.writerow(columns)  # headers
+        merged = heapq.merge(*(read_run(run) for run in runs), key=lambda row: ip_key(row[0]))
+        for ip, rows in itertools.groupby(merged, key=lambda row: row[0]):
+            writer.writerow(combine_rows(ip, list(rows), columns))
+    print(f"merged {len(filenames)} inputs in {len(runs)} sorted runs into {output_filename}")
 
-import polars as pl
-df = pl.read_csv("combined_results.csv", separator=";")
-df = df.with_columns(
-    df["ip"].str.extract(r"^(.*)\.[^.]+$", 1).alias("network-24")
-)
-df_grouped = df.filter(pl.col("router-vendor").is_not_null()).group_by(["network-24","router-vendor", "model-version", "successful-protocols", "banner-hash"]).agg(
-    pl.len().alias("no-of-ips")
-).sort(by="no-of-ips", descending=True)
-df_grouped.write_csv("fingerprinting_dealiased.csv", separator=";") 
\ No newline at end of file
+
+def network_key(base: pl.Expr, length) -> pl.Expr:
+    """network address and prefix length in one integer, so networks of all granularities share a column"""
+    return base.cast(pl.UInt64) * 64 + length
+
+
+def network_name(key: pl.Expr) -> pl.Expr:
+    """a.b.c.d/length of a network_key"""
+    return pl.concat_str([uint32_to_ipv4(key // 64), pl.lit("/"), (key % 64).cast(pl.String)])
+
+
+def bgp_networks(enriched_filename) -> pl.LazyFrame:
+    """ip | bgp-prefix (network_key) of the enriched fingerprinting results"""
+    prefix = pl.col("BGP-Prefix").str.split_exact("/", 1)
+    return (
+        pl.scan_csv(enriched_filename, separator=";", infer_schema=False)
+        .select(
+            ip=ipv4_to_uint32(pl.col("ip")).cast(pl.UInt64),
+            base=ipv4_to_uint32(prefix.struct.field("field_0")),
+            length=prefix.struct.field("field_1").cast(pl.UInt64, strict=False),
+        )
+        .select("ip", network_key(pl.col("base"), pl.col("length")).alias("bgp-prefix"))
+        .drop_nulls()
+        .unique("ip")
+    )
+
+
+def dealias(results: pl.LazyFrame, prefix_lengths=PREFIX_LENGTHS, bgp: pl.LazyFrame = None) -> pl.DataFrame:
+    """
+    number of IPs of every device per network (granularity | network | DEVICE_COLUMNS | no-of-ips).
+    The granularities are prefix-<length> for every prefix length and bgp-prefix if bgp is given,
+    IPs that are not IPv4 addresses (or without a BGP prefix) are left out.
+    """
+    devices = (
+        results.filter(pl.col("router-vendor").is_not_null())
+        .select(ipv4_to_uint32(pl.col("ip")).cast(pl.UInt64).alias("ip"), *DEVICE_COLUMNS)
+        .drop_nulls("ip")
+    )
+    granularities = [f"prefix-{length}" for length in prefix_lengths]
+    if bgp is not None:
+        devices = devices.join(bgp, on="ip", how="left")
+        granularities.append("bgp-prefix")
+    return (
+        devices.with_columns(
+            network_key(pl.col("ip") // (1 << (32 - length)) * (1 << (32 - length)), length).alias(f"prefix-{length}")
+            for length in prefix_lengths
+        )
+        .unpivot(index=DEVICE_COLUMNS, on=granularities, variable_name="granularity", value_name="network")
+        .drop_nulls("network")
+        .group_by(["granularity", "network", *DEVICE_COLUMNS])
+        .agg(pl.len().alias("no-of-ips"))
+        .with_columns(network_name(pl.col("network")).alias("network"))
+        .sort(["granularity", "no-of-ips"], descending=[False, True])
+        .collect()
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the fingerprinting results and dealias them per network")
+    parser.add_argument("inputs", nargs="*", help="results of analyze_vendors.py, merged if there are several")
+    parser.add_argument("--enriched", type=str, default=None, help="enriched results with a BGP-Prefix column")
+    parser.add_argument("--prefix-lengths", type=int, nargs="+", default=list(PREFIX_LENGTHS))
+    parser.add_argument("--rows-per-run", type=int, default=ROWS_PER_RUN, help="rows sorted in memory at once")
+    args = parser.parse_args()
+
+    if len(args.inputs) > 1:
+        combine_results(args.inputs, rows_per_run=args.rows_per_run)
+
+    # only the columns and rows of the dealiasing are read from the merged output
+    df_grouped = dealias(
+        pl.scan_csv("combined_results.csv", separator=";"),
+        args.prefix_lengths,
+        bgp_networks(args.enriched) if args.enriched is not None else None,
+    )
+    df_grouped.write_csv("fingerprinting_dealiased.csv", separator=";")
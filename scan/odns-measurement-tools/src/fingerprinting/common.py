@@ -1,7 +1,54 @@
 import hashlib
+import sqlite3
+import time
 
 def hash_string(input_string: str, algorithm="sha256") -> str:
     """Hashes a string using the specified algorithm and returns the hex digest."""
     hasher = hashlib.new(algorithm)
     hasher.update(input_string.encode('utf-8'))
-    return hasher.hexdigest()
\ No newline at end of file
+    return hasher.hexdigest()
+
+# titles and contents of http error pages
+error_texts = [
+    "404 Not Found",
+    "404 - Not Found",
+    "403 Forbidden",
+    "403 - Forbidden", 
+    "502 Bad Gateway",
+    "502 - Bad Gateway",
+    "500 - Internal Server Error",
+    "500 Internal Server Error",
+    "Site Not Found"
+]
+
+def is_error_page(page_title: str, page_source: str) -> bool:
+    """True if the title or the html of a page contains one of the error_texts"""
+    page_title, page_source = page_title.lower(), page_source.lower()
+    return any(error.lower() in page_title or error.lower() in page_source for error in error_texts)
+
+
+class WorkLedger:
+    """
+    Persistent record of finished work (an IP, the progress of a run) and its outcome in sqlite,
+    an interrupted run skips what the ledger already holds. Several processes may open the same ledger.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=300)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ledger (key TEXT PRIMARY KEY, outcome TEXT, finished REAL)")
+
+    def outcome(self, key):
+        """recorded outcome of key, None if it was not finished yet"""
+        row = self.db.execute("SELECT outcome FROM ledger WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def __contains__(self, key):
+        return self.outcome(key) is not None
+
+    def record(self, key, outcome):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO ledger VALUES (?, ?, ?)", (key, outcome, time.time()))
+
+    def close(self):
+        self.db.close()
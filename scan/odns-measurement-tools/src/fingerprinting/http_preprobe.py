@@ -0,0 +1,150 @@
+"""
+Fetches the raw page of every IP with asyncio before selenium_analyze.py is run.
+
+Most hosts are unresponsive or serve plain html, a headless Chrome is only needed for pages that are rendered
+by javascript (router UIs that build the page in the browser, frames, redirects by script).
+Pages that do not need a browser are written to output_selenium/{ok,error}/html like selenium_analyze.py does,
+unresponsive hosts are dropped and the remaining IPs are written to a list for selenium_analyze.py.
+
+call like this: python http_preprobe.py <ip list> [-o <ips for selenium>] [-c <concurrent requests>]
+for a local test server: python http_preprobe.py ips.txt --port 8000
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+
+import aiohttp
+
+from common import is_error_page
+
+OUTPUT_DIR = "output_selenium"
+SELENIUM_IPS_FILE = "preprobe_selenium_ips.txt"
+
+# like the selenium timeouts: a short one to reach the host, a long one for the whole page
+CONNECT_TIMEOUT = 2
+TOTAL_TIMEOUT = 20
+CONCURRENCY = 512
+# bytes of a page that are read at most
+MAX_PAGE_SIZE = 2 << 20
+
+# pages containing any of these need a browser to show their content
+BROWSER_MARKERS = [
+    "<frameset",
+    "<iframe",
+    "http-equiv=\"refresh\"",
+    "http-equiv='refresh'",
+    "http-equiv=refresh",
+    "window.location",
+    "location.href",
+    "location.replace",
+    "document.write",
+    "<noscript",
+]
+# pages with scripts and less visible text than this are assumed to be rendered by javascript
+MIN_STATIC_TEXT = 200
+
+SCRIPT_OR_STYLE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+TAG = re.compile(r"<[^>]*>")
+TITLE = re.compile(r"<title[^>]*>(.*?)</title", re.IGNORECASE | re.DOTALL)
+WHITESPACE = re.compile(r"\s+")
+
+
+def visible_text(html):
+    """text of the page without scripts, styles, tags and whitespace runs"""
+    return WHITESPACE.sub(" ", TAG.sub(" ", SCRIPT_OR_STYLE.sub(" ", html))).strip()
+
+
+def needs_browser(html):
+    html_lower = html.lower()
+    if any(marker in html_lower for marker in BROWSER_MARKERS):
+        return True
+    return "<script" in html_lower and len(visible_text(html)) < MIN_STATIC_TEXT
+
+
+def page_title(html):
+    match = TITLE.search(html)
+    return match.group(1).strip() if match else ""
+
+
+def classify(html):
+    """'empty', 'selenium', 'error' or 'ok' for the raw html of a page"""
+    if not html.strip():
+        return "empty"
+    if needs_browser(html):
+        return "selenium"
+    return "error" if is_error_page(page_title(html), html) else "ok"
+
+
+async def probe(session, url):
+    """(classification, raw html) of the url, see classify; 'unresponsive' if the host does not answer"""
+    try:
+        async with session.get(url, allow_redirects=True, max_redirects=5) as response:
+            body = await response.content.read(MAX_PAGE_SIZE)
+            html = body.decode(response.charset or "utf-8", errors="replace")
+    except (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.TooManyRedirects):
+        return "unresponsive", None
+    except (aiohttp.ClientError, LookupError, ValueError):
+        # anything but a plain http answer is left to the browser
+        return "selenium", None
+    return classify(html), html
+
+
+async def probe_worker(session, queue, url_template, results, selenium_ips):
+    while True:
+        ip = await queue.get()
+        if ip is None:
+            return
+        result, html = await probe(session, url_template.format(ip=ip))
+        results[result] += 1
+        if result == "selenium":
+            selenium_ips.write(f"{ip}\n")
+        elif result in ("ok", "error"):
+            with open(os.path.join(OUTPUT_DIR, result, "html", f"{ip}.html"), "w", encoding="utf-8") as html_file:
+                html_file.write(html)
+
+
+async def preprobe(input_file, selenium_ips_file, url_template, concurrency=CONCURRENCY):
+    """
+    Probes every IP of input_file with at most concurrency requests at a time and one shared connection pool.
+    The input is streamed into a bounded queue, so the IP list is never held in memory.
+    """
+    for result in ("ok", "error"):
+        os.makedirs(os.path.join(OUTPUT_DIR, result, "html"), exist_ok=True)
+
+    results = dict.fromkeys(("ok", "error", "selenium", "empty", "unresponsive"), 0)
+    timeout = aiohttp.ClientTimeout(total=TOTAL_TIMEOUT, sock_connect=CONNECT_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False)
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    with open(input_file, "r") as infile, open(selenium_ips_file, "w") as selenium_ips:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            workers = [asyncio.create_task(probe_worker(session, queue, url_template, results, selenium_ips))
+                       for _ in range(concurrency)]
+            for line in infile:
+                if line.strip():
+                    await queue.put(line.strip())
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch pages without a browser, list the IPs that need selenium")
+    parser.add_argument("input", type=str, help="file with one IP per line")
+    parser.add_argument("-o", "--output", type=str, default=SELENIUM_IPS_FILE, help="IPs for selenium_analyze.py")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY, help="concurrent requests")
+    parser.add_argument("--port", type=int, default=None, help="port of the http servers (default 80)")
+    args = parser.parse_args()
+    if not os.path.isfile(args.input):
+        print("input file does not exist")
+        sys.exit(1)
+
+    url_template = "http://{ip}" if args.port is None else f"http://{{ip}}:{args.port}"
+    start_t = time.perf_counter()
+    results = asyncio.run(preprobe(args.input, args.output, url_template, args.concurrency))
+    print(f"probed {sum(results.values())} IPs in {time.perf_counter() - start_t:.1f}s: "
+          + ", ".join(f"{count} {result}" for result, count in results.items()))
+    print(f"IPs for selenium written to: {args.output}")
@@ -1,4 +1,6 @@
 import os
+import csv
+import socket
 import time
 import sys
 from selenium import webdriver
@@ -10,10 +12,14 @@ from selenium.common.exceptions import TimeoutException, WebDriverException
 from multiprocessing import Lock
 from multiprocessing import Pool, cpu_count
 import multiprocessing
+import threading
+from queue import Empty
+from common import WorkLedger, is_error_page
 
 print("starting")
 
-ip_queue = multiprocessing.Queue()
+# the input is streamed into the queue, only a few ips per worker are waiting at a time
+ip_queue = multiprocessing.Queue(maxsize=256)
 
 if len(sys.argv) < 2:
         print("missing input filepath")
@@ -27,28 +33,156 @@ os.makedirs(os.path.join(OUTPUT_DIR,"ok", "screens"), exist_ok=True)
 os.makedirs(os.path.join(OUTPUT_DIR,"error", "html"), exist_ok=True)
 os.makedirs(os.path.join(OUTPUT_DIR,"ok", "html"), exist_ok=True)
 
-# read ips from input file
-with open(INPUT_FILE, "r") as file:
-    for line in file:
-        if line.strip():
-            ip_queue.put(line.strip())
-
-error_texts = [
-    "404 Not Found",
-    "404 - Not Found",
-    "403 Forbidden",
-    "403 - Forbidden", 
-    "502 Bad Gateway",
-    "502 - Bad Gateway",
-    "500 - Internal Server Error",
-    "500 Internal Server Error",
-    "Site Not Found"
-]
+# page load timeouts [s]: the first load of a host may take FIRST_TIMEOUT plus RTT_FACTOR round trips to it,
+# a host that sent partial content within that time is loaded again with RETRY_TIMEOUT
+FIRST_TIMEOUT = 2
+RETRY_TIMEOUT = 20
+RTT_FACTOR = 10
+# longest wait for the scripts of a blank page to render it
+RENDER_TIMEOUT = 10
+# the network of a page is idle when it did not request another resource for this long [s]
+NETWORK_IDLE = 1
+
+# seconds every ip spent in each stage
+TIMINGS_FILE = os.path.join(OUTPUT_DIR, "timings.csv")
+TIMING_HEADERS = ["ip", "worker", "result", "rtt", "load_timeout", "load", "render_wait", "screenshot", "write"]
+
+# every finished ip and its result, a restarted run skips them (delete the ledger to start over)
+LEDGER_FILE = os.path.join(OUTPUT_DIR, "ledger.sqlite")
+# results of ips that are tried again by a restarted run
+RETRY_RESULTS = ("webdriver-exception", "exception")
+
+EMPTY_PAGE = "<html><head></head><body></body></html>"
+
+IS_BLANK = """
+    if (!document.body) return true;
+    return document.body.innerText.trim() === "" || 
+        document.body.children.length === 0 ||
+        document.documentElement.innerHTML.replace(/\\s/g, '').length < 50;
+"""
+RESOURCE_COUNT = "return performance.getEntriesByType('resource').length;"
 
 def print_w(id, msg):
     print(f"[Worker {id}] {msg}")
 
-def browser_worker(id, queue):
+def host_rtt(ip, port=80):
+    """time to connect to the host [s], raises OSError (e.g. socket.timeout) if it cannot be reached"""
+    start_t = time.perf_counter()
+    with socket.create_connection((ip, port), timeout=FIRST_TIMEOUT):
+        return time.perf_counter() - start_t
+
+class NetworkIdle:
+    """wait condition, true once the page did not request another resource for idle_time seconds"""
+
+    def __init__(self, idle_time=NETWORK_IDLE):
+        self.idle_time = idle_time
+        self.count = None
+        self.since = time.monotonic()
+
+    def __call__(self, driver):
+        count = driver.execute_script(RESOURCE_COUNT)
+        now = time.monotonic()
+        if count != self.count:
+            self.count, self.since = count, now
+        return now - self.since >= self.idle_time
+
+def rendered(driver, network_idle):
+    return not driver.execute_script(IS_BLANK) or network_idle(driver)
+
+def process_ip(id, driver, ip, timing):
+    """loads, renders and saves the page of ip, returns the result for the timings"""
+    url = f"http://{ip}"
+    print_w(id, f"Processing {url}")
+
+    # hosts that cannot be reached do not cost a page load, the others get a timeout matching their distance
+    try:
+        rtt = host_rtt(ip)
+    except socket.timeout:
+        print_w(id,f"IP {ip} unresponsive")
+        return "unresponsive"
+    except OSError:
+        print_w(id,f"{url} address unreachable or refused")
+        return "refused"
+    timing["rtt"] = rtt
+    timing["load_timeout"] = load_timeout = min(FIRST_TIMEOUT + RTT_FACTOR * rtt, RETRY_TIMEOUT)
+
+    # the session is reused, until the page of ip is committed the browser still shows the previous one
+    previous_url = driver.current_url
+    start_t = time.perf_counter()
+    try:
+        driver.set_page_load_timeout(load_timeout)
+        driver.get(url)
+    except TimeoutException:
+        print_w(id,f"1st Timeout while loading {url}")
+        if driver.current_url != previous_url and driver.page_source.strip() != EMPTY_PAGE:
+            print_w(id,"got partial page content, retrying")
+            try:
+                # retry with higher timeout
+                driver.set_page_load_timeout(RETRY_TIMEOUT)
+                driver.get(url)
+            except TimeoutException:
+                print_w(id,f"2nd Timeout while loading {url}, aborting")
+                return "timeout"
+        else:
+            print_w(id,f"IP {ip} unresponsive")
+            return "unresponsive"
+    finally:
+        timing["load"] = time.perf_counter() - start_t
+
+    if driver.page_source.strip() == EMPTY_PAGE:
+        print_w(id,f"{url} empty page")
+        return "empty"
+
+    page_title = driver.title.strip()
+
+    if is_error_page(page_title, driver.page_source):
+        print_w(id,f"Error page detected ({page_title}). Skipping {url}.")
+        result = "error"
+    else: 
+        result = "ok"
+    screenshot_path = os.path.join(OUTPUT_DIR, result, "screens", f"{ip}.png")
+    html_path = os.path.join(OUTPUT_DIR, result, "html", f"{ip}.html")
+
+    # pages built by scripts: wait until they show content or stopped loading instead of a fixed time
+    start_t = time.perf_counter()
+    try:
+        WebDriverWait(driver, RENDER_TIMEOUT, poll_frequency=0.2).until(
+            lambda d, network_idle=NetworkIdle(): rendered(d, network_idle))
+    except TimeoutException:
+        pass
+    timing["render_wait"] = time.perf_counter() - start_t
+
+    # save screenshot and html
+    start_t = time.perf_counter()
+    driver.save_screenshot(screenshot_path)
+    timing["screenshot"] = time.perf_counter() - start_t
+    start_t = time.perf_counter()
+    with open(html_path, "w", encoding="utf-8") as html_file:
+        html_file.write(driver.page_source)
+    timing["write"] = time.perf_counter() - start_t
+
+    print_w(id,f"Saved: {screenshot_path}, {html_path}")
+    return result
+
+def feed_ips(input_file, queue, num_workers):
+    """streams the ips of the input file into the queue, skipping the finished ips of the ledger, then one poison per worker"""
+    ledger = WorkLedger(LEDGER_FILE)
+    skipped = 0
+    with open(input_file, "r") as file:
+        for line in file:
+            ip = line.strip()
+            if not ip:
+                continue
+            if ledger.outcome(ip) not in (None, *RETRY_RESULTS):
+                skipped += 1
+                continue
+            queue.put(ip)
+    ledger.close()
+    print(f"skipped {skipped} IPs finished by earlier runs")
+    for _ in range(num_workers):
+        queue.put(None)
+
+def browser_worker(id, queue, driver_path, timings):
     chrome_options = Options()
     chrome_options.add_argument("--headless")
     #chrome_options.add_argument("--disable-gpu")
@@ -57,96 +191,80 @@ def browser_worker(id, queue):
     chrome_options.add_argument("--ignore-certificate-errors") 
     chrome_options.add_argument("--window-size=1400,900")
 
-    # start webdriver
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+    # start webdriver, the browser session is used for all ips of the worker
+    driver = webdriver.Chrome(service=Service(driver_path), options=chrome_options)
     # open each ip
     while True:
         ip = queue.get()
         if ip is None: # quit on poison
             driver.quit()
+            timings.put(None)
             print_w(id, "Finished processing all IPs.")
             return
 
-        url = f"http://{ip}"
+        timing = {"ip": ip, "worker": id}
         try:
-            print_w(id, f"Processing {url}")
-
-            driver.get("about:blank")
-            # try with low timeout
-            try:
-                driver.set_page_load_timeout(2)
-                driver.get(url)
-            except TimeoutException:
-                print_w(id,f"1st Timeout while loading {url}")
-                if driver.page_source.strip() != "<html><head></head><body></body></html>":
-                    print_w(id,"got partial page content, retrying")
-                    try:
-                        # retry with higher timeout
-                        driver.set_page_load_timeout(20)
-                        driver.get(url)
-                    except TimeoutException:
-                        print_w(id,f"2nd Timeout while loading {url}, aborting")
-                        continue
-                else:
-                    print_w(id,f"IP {ip} unresponsive")
-                    continue
-
-            if driver.page_source.strip() == "<html><head></head><body></body></html>": 
-                print_w(id,f"{url} empty page")
-                continue
-
-            #print(driver.page_source.strip())
-
-            page_title = driver.title.strip()
-            page_source = driver.page_source.lower()
-
-            if any(error.lower() in page_title.lower() or error.lower() in page_source for error in error_texts):
-                print_w(id,f"Error page detected ({page_title}). Skipping {url}.")
-                screenshot_path = os.path.join(OUTPUT_DIR, "error", "screens", f"{ip}.png")
-                html_path = os.path.join(OUTPUT_DIR, "error", "html", f"{ip}.html")
-            else: 
-                screenshot_path = os.path.join(OUTPUT_DIR, "ok", "screens", f"{ip}.png")
-                html_path = os.path.join(OUTPUT_DIR, "ok", "html", f"{ip}.html")
-
-            is_blank = driver.execute_script("""
-                    if (!document.body) return true;
-                    return document.body.innerText.trim() === "" || 
-                        document.body.children.length === 0 ||
-                        document.documentElement.innerHTML.replace(/\\s/g, '').length < 50;
-                """)
-            if is_blank:
-                time.sleep(10)
-
-            # save screenshot and html
-            driver.save_screenshot(screenshot_path)
-            with open(html_path, "w", encoding="utf-8") as html_file:
-                html_file.write(driver.page_source)
-
-            print_w(id,f"Saved: {screenshot_path}, {html_path}")
+            timing["result"] = process_ip(id, driver, ip, timing)
         except WebDriverException as e:
             error_msg = str(e)
             if "ERR_ADDRESS_UNREACHABLE" in error_msg or "ERR_CONNECTION_REFUSED" in error_msg:
-                print_w(id,f"{url} {"address unreachable or refused"}")
-            print_w(id, f"{url} WebDriverException")
+                print_w(id,f"http://{ip} address unreachable or refused")
+            print_w(id, f"http://{ip} WebDriverException")
+            timing["result"] = "webdriver-exception"
         except Exception as e:
-            print_w(id,f"Error processing {url}: {e}")
+            print_w(id,f"Error processing http://{ip}: {e}")
+            timing["result"] = "exception"
+        timings.put(timing)
 
 if __name__ == "__main__":
     num_workers = 24
     print(f"Using {num_workers} parallel processes")
 
+    # the driver is installed once, so the workers can start at the same time
+    driver_path = ChromeDriverManager().install()
+    timings = multiprocessing.Queue()
     processes = []
 
     # use multiple processes =selenium instances so it's faster
     for i in range(num_workers):
-        ip_queue.put(None)
-        p = multiprocessing.Process(target=browser_worker, args=(i,ip_queue))
+        p = multiprocessing.Process(target=browser_worker, args=(i,ip_queue,driver_path,timings))
         p.start()
         processes.append(p)
-        time.sleep(2)
+
+    # the feeder blocks while the queue is full, it must not keep the main process alive if all workers died
+    threading.Thread(target=feed_ips, args=(INPUT_FILE, ip_queue, num_workers), daemon=True).start()
+
+    # the results of all workers are written to the ledger and the timings by the main process until every worker finished
+    ledger = WorkLedger(LEDGER_FILE)
+    totals = dict.fromkeys(TIMING_HEADERS[5:], 0.0)
+    new_timings = not os.path.isfile(TIMINGS_FILE)
+    with open(TIMINGS_FILE, "a", newline="") as timings_file:
+        writer = csv.DictWriter(timings_file, fieldnames=TIMING_HEADERS, delimiter=";")
+        if new_timings:
+            writer.writeheader()
+        finished = 0
+        while finished < num_workers:
+            try:
+                timing = timings.get(timeout=5)
+            except Empty:
+                # a worker whose browser did not start never reports
+                if not any(p.is_alive() for p in processes):
+                    break
+                continue
+            if timing is None:
+                finished += 1
+                continue
+            ledger.record(timing["ip"], timing["result"])
+            writer.writerow(timing)
+            timings_file.flush()
+            for stage in totals:
+                totals[stage] += timing.get(stage, 0.0)
+
+    ledger.close()
 
     for p in processes:
         p.join()
 
+    print("time per stage: " + ", ".join(f"{stage} {total:.0f}s" for stage, total in totals.items()))
+    print(f"timings written to: {TIMINGS_FILE}")
     print("done")
@@ -0,0 +1,74 @@
+"""
+Memory benchmark: outstanding requests of a zmap worker
+compares the former dict of OutputItem dataclasses keyed on (dnsid, port) tuples with PendingRequests
+
+call like this: python bench_pending_requests.py [number of requests]
+"""
+from dataclasses import dataclass
+from ipaddress import ip_address
+import random
+import sys
+import time
+import tracemalloc
+
+from pending_requests import PendingRequests, pack_key
+
+
+# layout of OutputItem in postproc_data_udp_pure.py
+@dataclass
+class OutputItem:
+    id: str
+    target_ip: ip_address
+    response_ip: ip_address
+    arecord: ip_address
+    odns_type: str
+    timestamp_req: str
+    timestamp_resp: str
+    port: int
+    dnsid: int
+    dns_pkt_size: int
+    dns_rrs: str
+    dns_flags: int
+    dns_ttl: int
+
+
+def requests(n: int):
+    rnd = random.Random(0)
+    for i in range(n):
+        yield (str(rnd.randrange(65536)), rnd.randrange(1024, 65536), str(ip_address(rnd.getrandbits(32))),
+               f"2024-08-24 10:{i // 60000 % 60:02d}:{i // 1000 % 60:02d}.{i % 1000000:06d}")
+
+
+def dict_of_dataclasses(n: int):
+    output_df = {}
+    for dnsid, port, ip, ts in requests(n):
+        output_df[(dnsid, port)] = OutputItem("", ip_address(ip), None, None, "", ts, "", port, dnsid, -1, "", -1, -1)
+    return output_df
+
+
+def pending_requests(n: int):
+    pending = PendingRequests()
+    for dnsid, port, ip, ts in requests(n):
+        pending.put(pack_key(int(dnsid), port), int(ip_address(ip)), ts)
+    return pending
+
+
+def measure(fn, n: int):
+    # timing without tracemalloc, it slows down every allocation
+    start_t = time.perf_counter()
+    fn(n)
+    took = time.perf_counter() - start_t
+    tracemalloc.start()
+    store = fn(n)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(store), current, peak, took
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    print(f"{n} requests (duplicate keys overwrite each other)")
+    for name, fn in [("dict of OutputItem", dict_of_dataclasses), ("PendingRequests", pending_requests)]:
+        entries, current, peak, took = measure(fn, n)
+        print(f"{name:>20}: {entries} entries, {current / 2**20:8.1f} MiB ({current / entries:6.1f} B/entry), "
+              f"peak {peak / 2**20:8.1f} MiB, {took:.2f}s")
@@ -0,0 +1,169 @@
+"""
+Parity check: pure python and columnar (polars) engine of postproc_data_udp_pure.py
+runs both engines on synthetic zmap chunks and go scanner results and checks that they produce the same rows
+(the order of the rows differs between the engines, the sorted rows are compared)
+
+the zmap chunks reuse (dnsid, port) keys within and across files, answer requests of a file in the
+following files, mix in responses without a valid a-record pair and other query names and quote fields
+like zmap does (the a-records contain commas)
+
+call like this: python bench_udp_engines.py [events per file] [number of files]
+"""
+from collections import Counter
+import gzip
+import os
+import random
+import sys
+import tempfile
+import time
+
+import postproc_data_udp_pure as pure
+from shards import ShardWriter
+import udp_columnar
+
+NO_OF_COLUMNS = 25
+OTHER_QUERY_NAME = "example.org"
+
+
+def random_ip(rnd: random.Random) -> str:
+    return ".".join(str(rnd.randrange(1, 255)) for _ in range(4))
+
+
+def zmap_line(rnd: random.Random, ts: str, sip: str, ip: str, dnsid: int, sport: int, dport: int,
+              resp_flag: int, qname: str, recs: str) -> str:
+    fields = [""] * NO_OF_COLUMNS
+    values = {pure.InPos.TS: ts, pure.InPos.SIP: sip, pure.InPos.IP: ip, pure.InPos.ID: dnsid,
+              pure.InPos.SP: sport, pure.InPos.DP: dport, pure.InPos.RESP_FLAG: resp_flag,
+              pure.InPos.QNAME: qname, pure.InPos.RNAME: qname if resp_flag else "", pure.InPos.RECS: recs}
+    for pos, value in values.items():
+        fields[pos.value] = str(value)
+    # zmap quotes fields with separators, quotes around other fields must not matter either
+    return ";".join(f'"{f}"' if "," in f or rnd.random() < 0.1 else f for f in fields) + "\n"
+
+
+def a_records(rnd: random.Random, arecord: str) -> str:
+    choice = rnd.random()
+    if choice < 0.8:
+        pair = [arecord, pure.REFERENCE_IP]
+        rnd.shuffle(pair)
+        return ",".join(pair)
+    if choice < 0.9:
+        return arecord  # only one record
+    return f"{arecord},{random_ip(rnd)}"  # control ip missing
+
+
+def zmap_chunks(directory: str, n: int, no_of_files: int, seed: int = 0):
+    """writes no_of_files gzipped zmap chunks of n events each, returns their paths in order"""
+    rnd = random.Random(seed)
+    # few keys, so zmap reuses them within a file and across files
+    keys = [(dnsid, port) for dnsid in range(max(1, n // 40)) for port in range(1024, 1034)]
+    outstanding = []
+    paths = []
+    event = 0
+    for file_idx in range(no_of_files):
+        path = os.path.join(directory, f"zmap_{file_idx}.csv.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as out_file:
+            for _ in range(n):
+                event += 1
+                ts = f"2024-08-24 10:{event // 60000 % 60:02d}:{event // 1000 % 60:02d}.{event % 1000000:06d}"
+                qname = pure.REFERENCE_QUERY_NAME if rnd.random() < 0.95 else OTHER_QUERY_NAME
+                if outstanding and rnd.random() < 0.5:
+                    # answers the request, a former request with the same key or nothing at all
+                    dnsid, port, target = outstanding.pop(rnd.randrange(len(outstanding)))
+                    sip = target if rnd.random() < 0.6 else random_ip(rnd)
+                    arecord = sip if rnd.random() < 0.5 else random_ip(rnd)
+                    out_file.write(zmap_line(rnd, ts, sip, random_ip(rnd), dnsid, 53, port, 1, qname,
+                                             a_records(rnd, arecord)))
+                    if rnd.random() < 0.1:
+                        # second response to the same request
+                        out_file.write(zmap_line(rnd, ts, sip, random_ip(rnd), dnsid, 53, port, 1, qname,
+                                                 a_records(rnd, arecord)))
+                else:
+                    dnsid, port = rnd.choice(keys)
+                    target = random_ip(rnd)
+                    out_file.write(zmap_line(rnd, ts, random_ip(rnd), target, dnsid, port, 53, 0, qname, ""))
+                    outstanding.append((dnsid, port, target))
+        paths.append(path)
+    return paths
+
+
+def go_results(path: str, n: int, seed: int = 0):
+    """gzipped go scanner results with quoted fields, invalid a-records and unparsable ips"""
+    rnd = random.Random(seed)
+    with gzip.open(path, "wt", encoding="utf-8") as out_file:
+        for i in range(n):
+            target = random_ip(rnd)
+            response = target if rnd.random() < 0.6 else random_ip(rnd)
+            arecord = response if rnd.random() < 0.5 else random_ip(rnd)
+            recs = a_records(rnd, arecord) if rnd.random() < 0.95 else ""
+            if rnd.random() < 0.02:
+                target = "not-an-ip"
+            fields = [str(i), target, response, recs, f"2024-08-24 10:00:{i % 60:02d}.{i:06d}",
+                      f"2024-08-24 10:00:{i % 60:02d}.{i + 1:06d}", str(rnd.randrange(1024, 65536)),
+                      str(rnd.randrange(65536)), "64", "2", "33152", str(rnd.randrange(3600))]
+            out_file.write(";".join(f'"{f}"' if "," in f or rnd.random() < 0.1 else f for f in fields) + "\n")
+
+
+def read_rows(shard: str):
+    with gzip.open(shard, "rt", encoding="utf-8") as shard_file:
+        return sorted(shard_file.read().splitlines())
+
+
+def run_pure_zmap(files, shard):
+    pure.files = files
+    worker = pure.WorkerProcess(0, shard, "csv.gz", None, None, None)
+    worker.print = lambda msg: None
+    worker._writer = ShardWriter(shard, "csv.gz")
+    for idx in range(len(files)):
+        worker.process_file(idx)
+    worker._writer.close()
+
+
+def run_columnar_zmap(files, shard):
+    udp_columnar.process_zmap_results(files, [shard], "csv.gz", pure.NO_OF_FILES,
+                                      pure.REFERENCE_QUERY_NAME, pure.REFERENCE_IP)
+
+
+def run_pure_go(load_fname, shard):
+    writer = ShardWriter(shard, "csv.gz")
+    pure.process_go_results(load_fname, writer)
+    writer.close()
+
+
+def run_columnar_go(load_fname, shard):
+    writer = ShardWriter(shard, "csv.gz")
+    udp_columnar.process_go_results_columnar(load_fname, writer, pure.REFERENCE_IP, pure.THREAD_COUNT)
+    writer.close()
+
+
+def compare(name, pure_fn, columnar_fn, source, tmp_dir):
+    """runs both engines on source, prints their timings and the differences, returns the number of them"""
+    results = []
+    for engine, fn in [("pure", pure_fn), ("columnar", columnar_fn)]:
+        shard = os.path.join(tmp_dir, f"{name}_{engine}.csv.gz")
+        start_t = time.perf_counter()
+        fn(source, shard)
+        took = time.perf_counter() - start_t
+        results.append(read_rows(shard))
+        print(f"{name:>5} {engine:>8}: {len(results[-1])} rows, {took:.2f}s")
+    # duplicate rows have to appear equally often as well
+    only_pure = Counter(results[0]) - Counter(results[1])
+    only_columnar = Counter(results[1]) - Counter(results[0])
+    for engine, rows in [("pure", only_pure), ("columnar", only_columnar)]:
+        for row in sorted(rows)[:5]:
+            print(f"  only {engine}: {row}")
+    return sum(only_pure.values()) + sum(only_columnar.values())
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    no_of_files = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = zmap_chunks(tmp_dir, n, no_of_files)
+        go_fname = os.path.join(tmp_dir, "go_results.csv.gz")
+        go_results(go_fname, n)
+        print(f"{no_of_files} zmap chunks with {n} events each, {n} go scanner results")
+        differences = compare("zmap", run_pure_zmap, run_columnar_zmap, files, tmp_dir)
+        differences += compare("go", run_pure_go, run_columnar_go, go_fname, tmp_dir)
+    print("identical output" if not differences else f"{differences} rows differ")
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,56 @@
+"""
+Compact store for the outstanding DNS requests of a zmap worker
+
+A request is identified by the packed 32 bit key (dnsid << 16 | port).
+Instead of a full OutputItem per request only the target ip (as integer) and the request timestamp are kept,
+both in flat columns that are indexed by a slot number.
+"""
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+
+def pack_key(dnsid: int, port: int) -> int:
+    return (dnsid << 16) | port
+
+
+class PendingRequests:
+    __slots__ = ("_slots", "_ips", "_timestamps", "_free")
+
+    def __init__(self):
+        self._slots: Dict[int, int] = {}  # packed key -> slot
+        self._ips = array("I")            # target ip per slot
+        self._timestamps: List[bytes] = []  # request timestamp per slot
+        self._free: List[int] = []        # slots of removed requests
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._slots
+
+    def put(self, key: int, ip: int, timestamp: str):
+        """adds a request, a request with the same key is overwritten"""
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._ips)
+                self._ips.append(0)
+                self._timestamps.append(b"")
+            self._slots[key] = slot
+        self._ips[slot] = ip
+        self._timestamps[slot] = timestamp.encode("utf-8")
+
+    def pop(self, key: int) -> Optional[Tuple[int, str]]:
+        """removes a request and returns its (ip, timestamp), None if there is no such request"""
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return None
+        self._free.append(slot)
+        timestamp = self._timestamps[slot]
+        self._timestamps[slot] = b""
+        return self._ips[slot], timestamp.decode("utf-8")
+
+    def discard(self, key: int):
+        self.pop(key)
@@ -1,10 +1,22 @@
+from collections import OrderedDict
 from dataclasses import dataclass
 from ipaddress import ip_address
 from enum import Enum
+from multiprocessing import Process, Queue
+import argparse
 import gzip
-import sys
+from typing import Iterable, Iterator, List
+
+from shards import ShardWriter, merge_shards, shard_path
 
 REFERENCE_IP = "91.216.216.216"
+# ids that did not complete their handshake are evicted (oldest first) beyond this number of entries
+MAX_PENDING = 1_000_000
+# ids written out are remembered (oldest first forgotten) up to this number, later packets of them are ignored
+MAX_COMPLETED = 1_000_000
+# lines sent to a worker at once and batches queued per worker
+BATCH_SIZE = 10_000
+QUEUED_BATCHES = 8
 
 # this will more or less represent a single row of the output csv
 @dataclass
@@ -32,69 +44,148 @@ class InPos(Enum):
     FLAGS = 6
     RECS = 7
 
-# input csv id is key
-output_df: dict[int, OutputItem]= {}
-
-if len(sys.argv) == 3:
-    load_fname = sys.argv[1]
-    save_fname = sys.argv[2]
-else:
-    print("call like this: python postproc_data_tcp_pure.py <inputfile.csv.gz> <outputfile.csv.gz>")
-    exit(1)
-
-# we will read the input csv
-# as soon as we learn some new information from a line, the output "dataframe" will be updated
-# we will disregard any information not needed (like the port, & seqnums)
-# the response ip will be determined by the srcip of the PSH-ACK, this will be correct for both types of forwarders
-# we will only check if a SYN-ACK is in principle present in the input csv
-with gzip.open(load_fname, 'rt', encoding="utf-8") as input_file:
-    while line := input_file.readline():
+
+def process_lines(lines: Iterable[str], writer: ShardWriter, partition: int = 0, max_pending: int = MAX_PENDING,
+                  max_completed: int = MAX_COMPLETED):
+    """
+    we will read the input csv
+    as soon as we learn some new information from a line, the output "dataframe" will be updated
+    we will disregard any information not needed (like the port, & seqnums)
+    the response ip will be determined by the srcip of the PSH-ACK, this will be correct for both types of forwarders
+    we will only check if a SYN-ACK is in principle present in the input csv
+
+    an id is written out and freed as soon as its SYN, SYN-ACK and PSH-ACK have been seen
+    the last max_completed ids written out are remembered, so retransmissions and FINs after the PSH-ACK
+    do not create new entries which would never complete and take the place of ids still in flight
+    ids which never complete are evicted once more than max_pending ids are outstanding
+    """
+    # input csv id is key, insertion order = age
+    output_df: OrderedDict[str, OutputItem] = OrderedDict()
+    completed: OrderedDict[str, None] = OrderedDict()
+    evicted = 0
+    late = 0
+    for line in lines:
         # id,timestamp,ip,port,seqnum,acknum,flags,arecords -> Enum
         # 0 |    1    |2 | 3  |  4   | 5    | 6   | 7
         split = line.strip().split(";")
         if split[InPos.ID.value] in output_df:
             outitem = output_df[split[InPos.ID.value]]
+        elif split[InPos.ID.value] in completed:
+            late += 1
+            continue
         else:
             outitem = OutputItem(None, None, None, "","", 0,"")
             output_df[split[InPos.ID.value]] = outitem
+            if len(output_df) > max_pending:
+                output_df.popitem(last=False)
+                evicted += 1
 
         # we shall have a SYN
         if split[InPos.FLAGS.value] == "S":
             outitem.target_ip = ip_address(split[InPos.IP.value])
             outitem.timestamp_req = split[InPos.TS.value]
             outitem.integrity = outitem.integrity | 0x4
-	    # a SYN-ACK
+        # a SYN-ACK
         elif split[InPos.FLAGS.value] == "SA":
             outitem.integrity = outitem.integrity | 0x2
-	    # and a PSH-ACK or FIN-PSH-ACK
+        # and a PSH-ACK or FIN-PSH-ACK
         elif split[InPos.FLAGS.value] == "PA" or split[InPos.FLAGS.value] == "FPA":
             outitem.response_ip = ip_address(split[InPos.IP.value])
             outitem.timestamp_resp = split[InPos.TS.value]
             arecs = split[InPos.RECS.value].split(",")
             # there should be two entries, one of them the control ip
             if len(arecs) != 2:
-                output_df.pop(InPos.ID.value, None) # remove from output dict
                 continue
             try:
                 pos = arecs.index(REFERENCE_IP)
             except ValueError:
-                output_df.pop(InPos.ID.value, None) # remove from output dict
                 continue
             outitem.arecord = ip_address(arecs[1-pos])
-
             outitem.integrity = outitem.integrity | 0x1
+
+        # writeout as soon as the item is complete
+        if outitem.integrity == 0x7:
             outitem.classify()
+            writer.write_row((split[InPos.ID.value],
+                              outitem.target_ip,
+                              outitem.response_ip,
+                              outitem.arecord,
+                              outitem.odns_type,
+                              outitem.timestamp_req,
+                              outitem.timestamp_resp))
+            del output_df[split[InPos.ID.value]]
+            completed[split[InPos.ID.value]] = None
+            if len(completed) > max_completed:
+                completed.popitem(last=False)
+    if evicted or output_df:
+        print(f"[{partition}] {evicted + len(output_df)} ids without complete handshake ({evicted} evicted early)")
+    if late:
+        print(f"[{partition}] {late} packets of ids already written out ignored")
+
+
+def process_results(load_fname: str, writer: ShardWriter, max_pending: int = MAX_PENDING,
+                    max_completed: int = MAX_COMPLETED):
+    with gzip.open(load_fname, 'rt', encoding="utf-8") as input_file:
+        process_lines(input_file, writer, 0, max_pending, max_completed)
+
+
+def fan_out(load_fname: str, queues: List[Queue], batch_size: int = BATCH_SIZE):
+    """
+    reads the input once and sends its lines in batches to the workers, hash partitioned on the id
+    every queue is closed with None
+    """
+    batches = [[] for _ in queues]
+    with gzip.open(load_fname, 'rt', encoding="utf-8") as input_file:
+        for line in input_file:
+            partition = int(line.split(";", 1)[0]) % len(queues)
+            batches[partition].append(line)
+            if len(batches[partition]) >= batch_size:
+                queues[partition].put(batches[partition])
+                batches[partition] = []
+    for queue, batch in zip(queues, batches):
+        if batch:
+            queue.put(batch)
+        queue.put(None)
+
+
+def queued_lines(queue: Queue) -> Iterator[str]:
+    while (batch := queue.get()) is not None:
+        yield from batch
+
+
+def partition_worker(queue: Queue, shard: str, partition: int, max_pending: int, max_completed: int):
+    writer = ShardWriter(shard, "csv.gz")
+    process_lines(queued_lines(queue), writer, partition, max_pending, max_completed)
+    writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="classify the results of a tcp scan by resolver type")
+    parser.add_argument("input", type=str, help="tcp results of the go scanner (.csv.gz)")
+    parser.add_argument("output", type=str, help="output file (.csv.gz)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes, the ids are hash partitioned across them")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="maximum number of incomplete ids kept per process")
+    parser.add_argument("--max-completed", type=int, default=MAX_COMPLETED,
+                        help="maximum number of written out ids remembered per process")
+    args = parser.parse_args()
 
-# writeout
-with gzip.open(save_fname, "wt", encoding="utf-8") as out_file:
-    for id, item in output_df.items():
-        if item.integrity == 0x7:
-            out_file.write(f"{id}"
-                           f";{item.target_ip}"
-                           f";{item.response_ip}"
-                           f";{item.arecord}"
-                           f";{item.odns_type}"
-                           f";{item.timestamp_req}"
-                           f";{item.timestamp_resp}"
-                           "\n")
-        #else: print(f"integrity failing for {id},{item}")
+    shards = [shard_path(args.output, partition, "csv.gz") for partition in range(args.workers)]
+    if args.workers == 1:
+        writer = ShardWriter(shards[0], "csv.gz")
+        process_results(args.input, writer, args.max_pending, args.max_completed)
+        writer.close()
+    else:
+        # the input is decompressed and read once, the workers only parse the lines of their partition
+        queues = [Queue(maxsize=QUEUED_BATCHES) for _ in shards]
+        worker_pool: List[Process] = []
+        for partition, shard in enumerate(shards):
+            worker = Process(target=partition_worker,
+                             args=(queues[partition], shard, partition, args.max_pending, args.max_completed))
+            worker_pool.append(worker)
+            worker.start()
+        fan_out(args.input, queues)
+        for worker in worker_pool:
+            worker.join()
+    merge_shards(args.output, shards, "csv.gz")
@@ -1,15 +1,17 @@
 from dataclasses import dataclass
+import argparse
 import glob
 from ipaddress import ip_address
 from enum import Enum
 import gzip
 import sys
-from multiprocessing import Process, Queue, Value, Lock
-from threading import Thread
+from multiprocessing import Array, Process, Value, Lock
 import time
 import os
-from typing import Dict, List, Tuple
+from typing import List, Tuple
 from natsort import natsorted
+from pending_requests import PendingRequests, pack_key
+from shards import SHARD_FORMATS, ShardWriter, finalize, output_format, shard_path
 
 ##### vars #####
 # file 1: process all requests AND responses from file first file
@@ -23,7 +25,6 @@ REFERENCE_IP = "91.216.216.216"
 THREAD_COUNT = 15
 ################
 
-QUEUE = Queue()
 # this will more or less represent a single row of the output csv
 @dataclass
 class OutputItem:
@@ -77,26 +78,19 @@ class GoPos(Enum):
     DNS_TTL   = 11
 
 
-def writer_thread(save_fname: str):
-    # writeout
-    with open(save_fname, "w", encoding="utf-8") as out_file:
-        print("writer file opened")
-        while True:
-            item: OutputItem = QUEUE.get()
-            if item is None: # sentinel
-                break
-            out_file.write(f"{item.id}"
-                           f";{item.target_ip}"
-                           f";{item.response_ip}"
-                           f";{item.arecord}"
-                           f";{item.odns_type}"
-                           f";{item.timestamp_req}"
-                           f";{item.timestamp_resp}"
-                           f";{item.dns_flags}"
-                           f";{item.dns_ttl}"
-                           "\n")
-
-def process_go_results(load_fname: str):
+def output_row(item: OutputItem) -> Tuple:
+    # a single row of the output csv
+    return (item.id,
+            item.target_ip,
+            item.response_ip,
+            item.arecord,
+            item.odns_type,
+            item.timestamp_req,
+            item.timestamp_resp,
+            item.dns_flags,
+            item.dns_ttl)
+
+def process_go_results(load_fname: str, writer: ShardWriter):
     with gzip.open(load_fname, 'rt', encoding="utf-8") as input_file:
         while line := input_file.readline():
             line = line.replace('"','')
@@ -125,41 +119,44 @@ def process_go_results(load_fname: str):
                     split[GoPos.DNS_TTL.value] if len(split) >= 12 else -1
                 )
                 outitem.classify()
-                QUEUE.put(outitem)
+                writer.write_row(output_row(outitem))
             except ValueError:
                 continue
 
 
 class WorkerProcess(Process):
-    def __init__(self, pid: int, writeout_q :Queue, files_pos, files_pos_lock):
+    def __init__(self, pid: int, shard_fname: str, shard_format: str, shard_rows, files_pos, files_pos_lock):
         super().__init__()
         self._pid = pid
-        self._writeout_q = writeout_q
+        self._shard_fname = shard_fname
+        self._shard_format = shard_format
+        self._shard_rows = shard_rows
         self._files_pos = files_pos
         self._files_pos_lock = files_pos_lock
+        self._writer: ShardWriter = None
 
-    def process_resp_line(self, output_df: Dict[Tuple[int, str], OutputItem], csv_split: List[str]):
-        key =  (csv_split[InPos.ID.value],int(csv_split[InPos.DP.value]))  
-        if key not in output_df:
+    def process_resp_line(self, pending: PendingRequests, csv_split: List[str]):
+        key = pack_key(int(csv_split[InPos.ID.value]), int(csv_split[InPos.DP.value]))
+        if key not in pending:
             return
         arecs = csv_split[InPos.RECS.value].split(',')
         # there should be two entries, one of them the control ip
         if len(arecs) != 2 or REFERENCE_IP not in arecs:
             return
         arecord = ip_address(arecs[0] if arecs[1]==REFERENCE_IP else arecs[1])
-        outitem = output_df[(csv_split[InPos.ID.value],int(csv_split[InPos.DP.value]))]
-        outitem.response_ip = ip_address(csv_split[InPos.SIP.value])
-        outitem.arecord = arecord
+        target_ip, timestamp_req = pending.pop(key)
+        # only matched requests become an OutputItem
+        outitem = OutputItem("", ip_address(target_ip), ip_address(csv_split[InPos.SIP.value]), arecord, "",
+                             timestamp_req, "", int(csv_split[InPos.DP.value]), csv_split[InPos.ID.value], -1, "", -1, -1)
         outitem.classify()
-        self._writeout_q.put(outitem)
-        del output_df[(csv_split[InPos.ID.value],int(csv_split[InPos.DP.value]))]
+        self._writer.write_row(output_row(outitem))
 
     def process_file(self, idx: int):
         """
         idx: index of the file to be read
         """
         self.print(f"processing file {idx+1}")
-        output_df: Dict[(int, str), OutputItem]= {}
+        pending = PendingRequests()
         for offset in range(NO_OF_FILES):
             if idx+offset > len(files)-1:
                 break
@@ -171,15 +168,17 @@ class WorkerProcess(Process):
                     if REFERENCE_QUERY_NAME not in [split[InPos.RNAME.value],split[InPos.QNAME.value]]:
                         continue
                     if int(split[InPos.RESP_FLAG.value])==1: # response
-                        self.process_resp_line(output_df, split)
+                        self.process_resp_line(pending, split)
                     elif offset==0: # request (for everything except the first file we only want the responses)
-                        outitem = OutputItem("",ip_address(split[InPos.IP.value]),None, None, split[InPos.TS.value],"")
-                        output_df[(split[InPos.ID.value],int(split[InPos.SP.value]))] = outitem
-                    elif offset!=0 and (split[InPos.ID.value],int(split[InPos.SP.value])) in output_df.keys():
+                        key = pack_key(int(split[InPos.ID.value]), int(split[InPos.SP.value]))
+                        pending.put(key, int(ip_address(split[InPos.IP.value])), split[InPos.TS.value])
+                    else:
                         # zmap might have already reused this port and dnsid -> so if there is a request with the same key already in the dict, this one is removed
-                        del output_df[(split[InPos.ID.value],int(split[InPos.SP.value]))]
+                        pending.discard(pack_key(int(split[InPos.ID.value]), int(split[InPos.SP.value])))
 
     def run(self):
+        # every worker writes its own shard, no items are sent to the main process
+        self._writer = ShardWriter(self._shard_fname, self._shard_format)
         while True:
             with self._files_pos_lock:
                 if self._files_pos.value == len(files):
@@ -187,26 +186,52 @@ class WorkerProcess(Process):
                 file_idx = self._files_pos.value
                 self._files_pos.value = self._files_pos.value +1
             self.process_file(file_idx)
+        self._writer.close()
+        self._shard_rows[self._pid] = self._writer.rows
 
     def print(self, msg: str):
         print(f"[{self._pid}] {msg}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 3:
-        pattern = sys.argv[1]
-        save_fname = sys.argv[2]
-    else:
-        print("call like this: python postproc_data_tcp_pure.py </dir/file_pattern> <output_file>")
-        exit(1)
+    parser = argparse.ArgumentParser(description="classify the results of an udp scan by resolver type")
+    parser.add_argument("pattern", type=str, help="results file of the go scanner or glob pattern of zmap files (/dir/file_pattern)")
+    parser.add_argument("output", type=str, help="output file (.csv, .csv.gz or .parquet for --shard-format parquet)")
+    parser.add_argument("--engine", choices=["pure", "columnar"], default="pure",
+                        help="pure: line by line python, columnar: polars based")
+    parser.add_argument("--matcher", choices=["files", "sliding"], default="files",
+                        help="files: match a file with the following NO_OF_FILES-1 files, "
+                             "sliding: read every file once and keep requests for --window seconds (columnar engine only)")
+    parser.add_argument("--window", type=float, default=10.0,
+                        help="seconds a response may arrive after its request (sliding matcher)")
+    parser.add_argument("--shard-format", choices=SHARD_FORMATS, default=None,
+                        help="format of the per-worker output shards (default: by the extension of the output, "
+                             "parquet for .parquet, csv.gz otherwise)")
+    parser.add_argument("--sharded", action="store_true",
+                        help="keep the shards and write <output>.manifest.json instead of merging them into <output>")
+    args = parser.parse_args()
+    if args.matcher == "sliding" and args.engine != "columnar":
+        parser.error("the sliding matcher requires --engine columnar")
+    if args.shard_format is None:
+        args.shard_format = output_format(args.output)
+    elif not args.sharded and output_format(args.output) != args.shard_format:
+        parser.error(f"{args.shard_format} shards cannot be merged into {args.output}, "
+                     f"use --shard-format {output_format(args.output)} or --sharded")
+    pattern = args.pattern
+    save_fname = args.output
     start_t = time.time()
-    writeout_thread = Thread(target=writer_thread,args=[save_fname])
-    print('starting writeout thread...')
-    writeout_thread.start()
     # if the pattern is actually a file then the results of the gofile should be processed 
     if os.path.isfile(pattern):
         print("go script mode")
-        process_go_results(load_fname=pattern)
+        shards = [shard_path(save_fname, 0, args.shard_format)]
+        writer = ShardWriter(shards[0], args.shard_format)
+        if args.engine == "columnar":
+            from udp_columnar import process_go_results_columnar
+            process_go_results_columnar(pattern, writer, REFERENCE_IP, THREAD_COUNT)
+        else:
+            process_go_results(pattern, writer)
+        writer.close()
+        shard_rows = [writer.rows]
     # otherwise the results of the zmap scan (which is more complicated)
     else:
         print("zmap script mode")
@@ -218,19 +243,30 @@ if __name__ == "__main__":
         print(f"files[0]={files[0]},files[1]={files[1]},files[2]={files[2]}")
         print('read file list')
 
-        worker_pool: List[WorkerProcess] = []
-        for pid in range(THREAD_COUNT):
-            print(f"starting worker process {pid}")
-            worker = WorkerProcess(pid, QUEUE, files_pos, files_pos_lock)
-            worker_pool.append(worker)
-            worker.start()
-        
-        for worker in worker_pool:
-            worker.join()
-        print("all workers ended")
-
-    QUEUE.put(None) # ends the writer
-    writeout_thread.join()
+        shards = [shard_path(save_fname, pid, args.shard_format) for pid in range(THREAD_COUNT)]
+        if args.matcher == "sliding":
+            from udp_columnar import process_zmap_sliding
+            shards = shards[:1]
+            shard_rows = [process_zmap_sliding(files, shards[0], args.shard_format, args.window,
+                                               REFERENCE_QUERY_NAME, REFERENCE_IP, THREAD_COUNT)]
+        elif args.engine == "columnar":
+            from udp_columnar import process_zmap_results
+            shard_rows = process_zmap_results(files, shards, args.shard_format, NO_OF_FILES, REFERENCE_QUERY_NAME, REFERENCE_IP)
+        else:
+            shard_rows = Array('q', THREAD_COUNT)
+            worker_pool: List[WorkerProcess] = []
+            for pid in range(THREAD_COUNT):
+                print(f"starting worker process {pid}")
+                worker = WorkerProcess(pid, shards[pid], args.shard_format, shard_rows, files_pos, files_pos_lock)
+                worker_pool.append(worker)
+                worker.start()
+            
+            for worker in worker_pool:
+                worker.join()
+            print("all workers ended")
+            shard_rows = list(shard_rows)
+
+    finalize(save_fname, shards, shard_rows, args.shard_format, args.sharded)
     print("done")
     end_t = time.time()
     print(f"took:{end_t-start_t}s")
@@ -0,0 +1,210 @@
+"""
+Per-worker sharded output of the postprocessing scripts
+
+Every worker writes its rows into its own compressed shard, so no rows have to be sent between processes.
+At the end the shards are either merged into the requested output file or listed in a manifest.
+"""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from typing import List, Tuple
+
+# column order of the output csv
+OUTPUT_COLUMNS = ["id", "ip_request", "ip_response", "a_record", "response_type",
+                  "ts_request", "ts_response", "dns_flags", "dns_ttl"]
+INT_COLUMNS = ["dns_flags", "dns_ttl"]
+TS_COLUMNS = ["ts_request", "ts_response"]
+
+SHARD_FORMATS = ["csv.gz", "parquet"]
+# rows per row group of the shards and of the merged parquet file
+ROW_GROUP_SIZE = 500_000
+
+
+def arrow_schema():
+    import pyarrow as pa
+    return pa.schema([(col, pa.int64() if col in INT_COLUMNS else pa.string()) for col in OUTPUT_COLUMNS])
+
+
+def typed_arrow_schema():
+    """schema of the merged parquet file, the timestamps are stored as timestamps instead of strings"""
+    import pyarrow as pa
+    return pa.schema([(col, pa.timestamp("us")) if col in TS_COLUMNS else field
+                      for col, field in zip(OUTPUT_COLUMNS, arrow_schema())])
+
+
+def parse_timestamps(ts):
+    """
+    ts: polars Series of timestamps, either given as unix time or as date time string (2024-08-24 10:00:00.000001)
+    returns a Datetime(us) Series, empty and unparsable values become null
+    """
+    import polars as pl
+    ts = pl.select(pl.when(ts.str.strip_chars() != "").then(ts).alias(ts.name)).to_series()
+    numeric = ts.cast(pl.Float64, strict=False)
+    if numeric.null_count() == ts.null_count():
+        return (numeric * 1e6).round().cast(pl.Int64).cast(pl.Datetime("us"))
+    date_time = ts.str.extract(r"^(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?)", 1).str.replace("T", " ")
+    return date_time.str.strptime(pl.Datetime("us"), "%Y-%m-%d %H:%M:%S%.f", strict=False)
+
+
+def typed_table(table):
+    """table: pyarrow Table with the arrow_schema -> pyarrow Table with the typed_arrow_schema"""
+    import polars as pl
+    frame = pl.from_arrow(table)
+    frame = frame.with_columns([parse_timestamps(frame[col]) for col in TS_COLUMNS])
+    return frame.to_arrow().cast(typed_arrow_schema())
+
+
+def output_format(save_fname: str) -> str:
+    """shard format that is merged into save_fname: parquet for .parquet files, csv.gz for (compressed) csv"""
+    return "parquet" if save_fname.endswith(".parquet") else "csv.gz"
+
+
+def shard_path(save_fname: str, pid: int, fmt: str) -> str:
+    return f"{save_fname}.shard-{pid:03d}.{fmt}"
+
+
+class ShardWriter:
+    """
+    writes the output rows of a single worker
+    csv.gz: same lines as the single output file, gzip members can simply be concatenated
+    parquet: rows are buffered and written as one row group per batch
+    """
+    def __init__(self, path: str, fmt: str, batch_size: int = ROW_GROUP_SIZE):
+        self.path = path
+        self.fmt = fmt
+        self.rows = 0
+        self._batch_size = batch_size
+        self._batch: List[Tuple] = []
+        if fmt == "csv.gz":
+            self._file = gzip.open(path, "wb", compresslevel=6)
+        elif fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, arrow_schema(), compression="zstd")
+        else:
+            raise ValueError(f"unknown shard format {fmt}")
+
+    def write_row(self, row: Tuple):
+        self.rows += 1
+        if self.fmt == "csv.gz":
+            self._file.write((";".join(str(value) for value in row) + "\n").encode("utf-8"))
+        else:
+            self._batch.append(row)
+            if len(self._batch) >= self._batch_size:
+                self._flush()
+
+    def write_frame(self, frame):
+        """frame: polars DataFrame with the OUTPUT_COLUMNS in order"""
+        self.rows += frame.height
+        if self.fmt == "csv.gz":
+            frame.write_csv(self._file, separator=";", include_header=False, quote_style="never")
+        else:
+            self._writer.write_table(frame.to_arrow().rename_columns(OUTPUT_COLUMNS).cast(arrow_schema()))
+
+    def _flush(self):
+        if not self._batch:
+            return
+        import pyarrow as pa
+        columns = list(zip(*self._batch))
+        arrays = [
+            [int(v) if str(v).strip() else -1 for v in values] if col in INT_COLUMNS else [str(v) for v in values]
+            for col, values in zip(OUTPUT_COLUMNS, columns)
+        ]
+        self._writer.write_table(pa.table(arrays, schema=arrow_schema()))
+        self._batch = []
+
+    def close(self):
+        if self.fmt == "csv.gz":
+            self._file.close()
+        else:
+            self._flush()
+            self._writer.close()
+
+
+def merge_parquet(save_fname: str, shards: List[str], row_group_size: int = ROW_GROUP_SIZE):
+    """
+    merges the parquet shards into one typed file
+    the rows are ordered by response_type, so every row group holds a single type and a reader filtering
+    on response_type skips the other row groups by their statistics
+    every shard is read once, one row group at a time: its rows are split by response_type into one spill file
+    per type, the spill files are then appended to the output in the order of their types
+    """
+    import polars as pl
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    spills = {}
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(save_fname))) as spill_dir:
+        for shard in shards:
+            shard_file = pq.ParquetFile(shard)
+            for group in range(shard_file.num_row_groups):
+                frame = pl.from_arrow(typed_table(shard_file.read_row_group(group)))
+                for (response_type,), part in frame.partition_by("response_type", as_dict=True).items():
+                    if response_type not in spills:
+                        spill_fname = os.path.join(spill_dir, f"{len(spills)}.parquet")
+                        spills[response_type] = (spill_fname, pq.ParquetWriter(spill_fname, typed_arrow_schema()))
+                    spills[response_type][1].write_table(part.to_arrow().cast(typed_arrow_schema()))
+        for _, spill_writer in spills.values():
+            spill_writer.close()
+
+        with pq.ParquetWriter(save_fname, typed_arrow_schema(), compression="zstd") as writer:
+            for response_type in sorted(spills):
+                # the spill file is written in small row groups, they are combined into full ones
+                buffered = typed_arrow_schema().empty_table()
+                for batch in pq.ParquetFile(spills[response_type][0]).iter_batches(batch_size=row_group_size):
+                    buffered = pa.concat_tables([buffered, pa.Table.from_batches([batch])])
+                    while buffered.num_rows >= row_group_size:
+                        writer.write_table(buffered.slice(0, row_group_size))
+                        buffered = buffered.slice(row_group_size)
+                if buffered.num_rows:
+                    writer.write_table(buffered)
+
+
+def merge_shards(save_fname: str, shards: List[str], fmt: str):
+    """
+    merges the shards into save_fname and removes them
+    gzip members are copied as they are, parquet shards are merged into a typed file sorted by response_type
+    """
+    if output_format(save_fname) != fmt:
+        raise ValueError(f"{fmt} shards cannot be merged into {save_fname}")
+    if fmt == "parquet":
+        merge_parquet(save_fname, shards)
+    elif save_fname.endswith(".gz"):
+        with open(save_fname, "wb") as out_file:
+            for shard in shards:
+                with open(shard, "rb") as shard_file:
+                    shutil.copyfileobj(shard_file, out_file)
+    else:
+        with open(save_fname, "wb") as out_file:
+            for shard in shards:
+                with gzip.open(shard, "rb") as shard_file:
+                    shutil.copyfileobj(shard_file, out_file)
+    for shard in shards:
+        os.remove(shard)
+
+
+def write_manifest(save_fname: str, shards: List[str], rows: List[int], fmt: str) -> str:
+    """lists the shards of a run, paths are relative to the manifest"""
+    manifest_fname = f"{save_fname}.manifest.json"
+    base_dir = os.path.dirname(os.path.abspath(manifest_fname))
+    manifest = {
+        "format": fmt,
+        "columns": OUTPUT_COLUMNS,
+        "rows": sum(rows),
+        "shards": [
+            {"path": os.path.relpath(os.path.abspath(shard), base_dir), "rows": n}
+            for shard, n in zip(shards, rows)
+        ],
+    }
+    with open(manifest_fname, "w", encoding="utf-8") as out_file:
+        json.dump(manifest, out_file, indent=2)
+    return manifest_fname
+
+
+def finalize(save_fname: str, shards: List[str], rows: List[int], fmt: str, sharded: bool):
+    if sharded:
+        manifest_fname = write_manifest(save_fname, shards, rows, fmt)
+        print(f"wrote {len(shards)} shards, manifest: {manifest_fname}")
+    else:
+        merge_shards(save_fname, shards, fmt)
+        print(f"merged {len(shards)} shards into {save_fname}")
@@ -0,0 +1,369 @@
+"""
+Columnar (polars) engine for the zmap mode of postproc_data_udp_pure.py
+
+Instead of splitting every line in python, each zmap chunk is parsed by polars and reduced to
+the DNS events of interest (requests and responses for the reference query name).
+Requests are matched with responses on (dnsid, port) with window expressions and joins.
+The resulting rows are the same as the ones of the pure python engine, only their order differs.
+
+Alternatively the sliding window matcher reads every file exactly once and keeps the outstanding
+requests of the last seconds (instead of the requests of a single file) in memory.
+
+The results file of the go scanner already contains matched requests and responses,
+it is streamed in record batches and classified batch by batch.
+"""
+from collections import deque
+import gzip
+from concurrent.futures import Executor, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Iterable, Iterator, List
+
+import polars as pl
+from shards import ShardWriter, parse_timestamps
+
+# same positions as InPos in postproc_data_udp_pure.py
+ZMAP_COLUMNS = {
+    "ts": 1,
+    "sip": 2,
+    "ip": 4,
+    "dnsid": 5,
+    "sport": 6,
+    "dport": 7,
+    "resp_flag": 8,
+    "qname": 20,
+    "rname": 21,
+    "recs": 23,
+}
+
+# columns of the go scanner results (see GoPos in postproc_data_udp_pure.py)
+GO_COLUMNS = ["id", "target_ip", "response_ip", "arecords", "ts_req", "ts_resp",
+              "port", "dnsid", "pkt_size", "rrs", "dns_flags", "dns_ttl"]
+
+# an ip address as accepted by ipaddress.IPv4Address
+IPV4_REGEX = r"^(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(?:\.(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}$"
+
+KEY = ["dnsid", "port"]
+
+EVENT_SCHEMA = {
+    "row": pl.UInt32,
+    "is_resp": pl.Boolean,
+    "dnsid": pl.String,
+    "port": pl.Int64,
+    "ip": pl.String,
+    "ts": pl.String,
+    "arecord": pl.String,
+}
+
+
+def classify(target_ip: pl.Expr, response_ip: pl.Expr, arecord: pl.Expr) -> pl.Expr:
+    """vectorized version of OutputItem.classify"""
+    return (
+        pl.when(response_ip != target_ip).then(pl.lit("Transparent Forwarder"))
+        .when(arecord == response_ip).then(pl.lit("Resolver"))
+        .otherwise(pl.lit("Forwarder"))
+    )
+
+
+def arecord_pair(recs: pl.Expr, reference_ip: str):
+    """
+    returns (valid, arecord) expressions
+    there should be two entries, one of them the control ip, the other one is the a-record
+    """
+    arecs = recs.str.split(",")
+    valid = (arecs.list.len() == 2) & arecs.list.contains(reference_ip)
+    arecord = (
+        pl.when(arecs.list.get(1, null_on_oob=True) == reference_ip)
+        .then(arecs.list.get(0, null_on_oob=True))
+        .otherwise(arecs.list.get(1, null_on_oob=True))
+    )
+    return valid.fill_null(False), arecord
+
+
+def read_zmap_events(fname: str, query_name: str, reference_ip: str) -> pl.DataFrame:
+    """
+    reads a single zmap csv (gz) and returns all requests and all usable responses
+    for the reference query name in file order:
+    row | is_resp | dnsid | port | ip | ts | arecord
+    requests carry the target ip, responses the ip the response came from
+    responses without a valid a-record pair are dropped, they never change the matching state
+    """
+    indices = sorted(ZMAP_COLUMNS.values())
+    names = {v: k for k, v in ZMAP_COLUMNS.items()}
+    try:
+        df = pl.read_csv(fname, separator=";", has_header=False, columns=indices,
+                         infer_schema=False, quote_char='"', truncate_ragged_lines=True)
+    except pl.exceptions.NoDataError:
+        return pl.DataFrame(schema=EVENT_SCHEMA)
+    # column naming of headerless files differs between polars versions -> rename by position
+    df = df.rename(dict(zip(df.columns, [names[i] for i in indices])))
+
+    valid, arecord = arecord_pair(pl.col("recs"), reference_ip)
+    return (
+        df.lazy()
+        .with_row_index("row")
+        .filter((pl.col("rname") == query_name) | (pl.col("qname") == query_name))
+        .with_columns(is_resp=pl.col("resp_flag").str.strip_chars().cast(pl.Int64) == 1)
+        .with_columns(
+            port=pl.when(pl.col("is_resp"))
+                .then(pl.col("dport"))
+                .otherwise(pl.col("sport"))
+                .str.strip_chars().cast(pl.Int64),
+            ip=pl.when(pl.col("is_resp")).then(pl.col("sip")).otherwise(pl.col("ip")),
+            arecord=pl.when(pl.col("is_resp")).then(arecord),
+            valid=~pl.col("is_resp") | valid,
+        )
+        .filter(pl.col("valid"))
+        .select(EVENT_SCHEMA.keys())
+        .collect()
+    )
+
+
+def ts_seconds(ts: pl.Series) -> pl.Series:
+    """timestamps are either given as unix time or as date time string (2024-08-24 10:00:00.000001)"""
+    return parse_timestamps(ts).dt.epoch("us") / 1e6
+
+
+def output_frame(matches: pl.LazyFrame) -> pl.LazyFrame:
+    """matches: target_ip | ts_req | response_ip | arecord -> rows of the output csv"""
+    return matches.select(
+        id=pl.lit(""),
+        target_ip=pl.col("target_ip"),
+        response_ip=pl.col("response_ip"),
+        arecord=pl.col("arecord"),
+        odns_type=classify(pl.col("target_ip"), pl.col("response_ip"), pl.col("arecord")),
+        timestamp_req=pl.col("ts_req"),
+        timestamp_resp=pl.lit(""),
+        dns_flags=pl.lit(-1, dtype=pl.Int64),
+        dns_ttl=pl.lit(-1, dtype=pl.Int64),
+    )
+
+
+def match_window(first: pl.DataFrame, following: List[pl.DataFrame]) -> pl.DataFrame:
+    """
+    first: events of the file the requests are taken from
+    following: events of the subsequent files, only used for their responses
+
+    this is the columnar equivalent of WorkerProcess.process_file:
+    within the first file a response belongs to the request with the same key directly preceding it
+    (a later request with the same key overwrites the previous one, a response consumes it)
+    requests still outstanding at the end of the first file are resolved by the first event
+    with their key in the following files: a response is a match,
+    a request means zmap reused the port and dnsid -> the outstanding request is dropped
+    """
+    events = first.lazy().with_columns(
+        prev_is_resp=pl.col("is_resp").shift(1).over(KEY),
+        prev_ip=pl.col("ip").shift(1).over(KEY),
+        prev_ts=pl.col("ts").shift(1).over(KEY),
+        is_last=pl.col("row") == pl.col("row").max().over(KEY),
+    )
+    in_file = (
+        events
+        .filter(pl.col("is_resp") & ~pl.col("prev_is_resp"))
+        .select(target_ip="prev_ip", ts_req="prev_ts", response_ip="ip", arecord="arecord")
+    )
+    matches = [in_file]
+
+    if following:
+        pending = events.filter(pl.col("is_last") & ~pl.col("is_resp")).select(*KEY, "ip", "ts")
+        first_seen = (
+            pl.concat([f.lazy().with_columns(file=pl.lit(n)) for n, f in enumerate(following)])
+            .sort("file", "row")
+            .group_by(KEY, maintain_order=True)
+            .first()
+        )
+        late = (
+            pending.join(first_seen, on=KEY, how="inner", suffix="_resp")
+            .filter(pl.col("is_resp"))
+            .sort("file", "row")
+            .select(target_ip="ip", ts_req="ts", response_ip="ip_resp", arecord="arecord")
+        )
+        matches.append(late)
+
+    return output_frame(pl.concat(matches)).collect()
+
+
+def process_zmap_results(files: List[str], shards: List[str], shard_format: str, no_of_files: int,
+                         query_name: str, reference_ip: str) -> List[int]:
+    """
+    file idx is matched with the files idx+1 .. idx+no_of_files-1 exactly like the pure engine does
+    one worker thread per shard (polars releases the GIL), every worker writes only into its own shard
+    returns the number of rows per shard
+    """
+    files_pos = iter(range(len(files)))
+    files_pos_lock = Lock()
+
+    def worker(shard: str) -> int:
+        writer = ShardWriter(shard, shard_format)
+        while True:
+            with files_pos_lock:
+                idx = next(files_pos, None)
+            if idx is None:
+                break
+            window = files[idx:idx + no_of_files]
+            events = [read_zmap_events(fname, query_name, reference_ip) for fname in window]
+            writer.write_frame(match_window(events[0], events[1:]))
+            print(f"processed file {idx+1}")
+        writer.close()
+        return writer.rows
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        return list(executor.map(worker, shards))
+
+
+class SlidingWindowMatcher:
+    """
+    matches requests with responses while reading every file exactly once
+
+    outstanding requests are kept keyed on (dnsid, port) across files:
+    a response belongs to the outstanding request with the same key if it arrived within `window` seconds,
+    a newer request with the same key replaces the outstanding one (zmap reused the port and dnsid)
+    requests are evicted once they are older than twice the window,
+    until then responses to them are counted as late (outside the window) instead of matched
+    """
+    def __init__(self, window: float):
+        self.window = window
+        self.pending = pl.DataFrame(schema={"dnsid": pl.String, "port": pl.Int64, "ip": pl.String,
+                                            "ts": pl.String, "t": pl.Float64})
+        self.matched = 0
+        self.late = 0
+        self.reused = 0
+        self.unanswered = 0
+
+    def process(self, events: pl.DataFrame) -> pl.DataFrame:
+        """events of the next file (see read_zmap_events) -> rows of the output csv"""
+        events = events.with_columns(t=ts_seconds(events["ts"]), row=pl.col("row").cast(pl.Int64))
+        if events["t"].null_count() > 0:
+            raise ValueError("could not parse the timestamps of the zmap results")
+        # outstanding requests go first, they precede all events of this file
+        carried = self.pending.with_columns(row=pl.lit(-1, dtype=pl.Int64), is_resp=pl.lit(False),
+                                            arecord=pl.lit(None, dtype=pl.String))
+        timeline = pl.concat([carried, events], how="diagonal").with_columns(
+            prev_is_resp=pl.col("is_resp").shift(1).over(KEY),
+            prev_ip=pl.col("ip").shift(1).over(KEY),
+            prev_ts=pl.col("ts").shift(1).over(KEY),
+            age=pl.col("t") - pl.col("t").shift(1).over(KEY),
+            is_last=pl.int_range(pl.len()).over(KEY) == pl.len().over(KEY) - 1,
+        )
+        answered = timeline.filter(pl.col("is_resp") & ~pl.col("prev_is_resp"))
+        in_window = answered.filter(pl.col("age") <= self.window)
+        self.matched += in_window.height
+        self.late += answered.height - in_window.height
+        self.reused += timeline.filter(~pl.col("is_resp") & ~pl.col("prev_is_resp")).height
+
+        pending = timeline.filter(pl.col("is_last") & ~pl.col("is_resp")).select(self.pending.columns)
+        if events.height > 0:
+            horizon = events["t"].max() - 2 * self.window
+            self.unanswered += pending.filter(pl.col("t") < horizon).height
+            pending = pending.filter(pl.col("t") >= horizon)
+        self.pending = pending
+
+        return output_frame(
+            in_window.lazy().select(target_ip="prev_ip", ts_req="prev_ts", response_ip="ip", arecord="arecord")
+        ).collect()
+
+    def finish(self):
+        self.unanswered += self.pending.height
+        self.pending = self.pending.clear()
+
+    def report(self):
+        print(f"sliding window of {self.window}s: {self.matched} matched responses, "
+              f"{self.late} responses outside the window, {self.reused} reused (dnsid, port) pairs, "
+              f"{self.unanswered} unanswered requests")
+
+
+def prefetch(executor: Executor, fn: Callable, items: Iterable, depth: int) -> Iterator:
+    """ordered executor.map which submits at most `depth` items ahead of the consumer"""
+    futures = deque()
+    for item in items:
+        futures.append(executor.submit(fn, item))
+        if len(futures) >= depth:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def process_zmap_sliding(files: List[str], shard: str, shard_format: str, window: float,
+                         query_name: str, reference_ip: str, workers: int) -> int:
+    """
+    every file is read exactly once, files are parsed concurrently while the matching runs in file order
+    returns the number of rows written to the shard
+    """
+    matcher = SlidingWindowMatcher(window)
+    writer = ShardWriter(shard, shard_format)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        read = lambda fname: read_zmap_events(fname, query_name, reference_ip)  # noqa: E731
+        for idx, events in enumerate(prefetch(executor, read, files, workers)):
+            writer.write_frame(matcher.process(events))
+            print(f"processed file {idx+1}")
+    matcher.finish()
+    matcher.report()
+    writer.close()
+    return writer.rows
+
+
+def classify_go_batch(batch: pl.DataFrame, reference_ip: str) -> pl.DataFrame:
+    """
+    vectorized version of process_go_results for a batch of go scanner results
+    rows without a valid a-record pair or with an unparsable ip address are dropped
+    """
+    valid, arecord = arecord_pair(pl.col("arecords"), reference_ip)
+    return (
+        batch.lazy()
+        .filter(pl.col("arecords") != "")
+        .with_columns(valid=valid, arecord=arecord)
+        .filter(
+            pl.col("valid")
+            & pl.col("target_ip").str.contains(IPV4_REGEX)
+            & pl.col("response_ip").str.contains(IPV4_REGEX)
+            & pl.col("arecord").str.contains(IPV4_REGEX)
+        )
+        .select(
+            id=pl.col("id"),
+            target_ip=pl.col("target_ip"),
+            response_ip=pl.col("response_ip"),
+            arecord=pl.col("arecord"),
+            odns_type=classify(pl.col("target_ip"), pl.col("response_ip"), pl.col("arecord")),
+            timestamp_req=pl.col("ts_req"),
+            timestamp_resp=pl.col("ts_resp"),
+            dns_flags=pl.col("dns_flags"),
+            dns_ttl=pl.col("dns_ttl"),
+        )
+        .collect()
+    )
+
+
+def go_result_batches(load_fname: str, block_size: int) -> Iterator[pl.DataFrame]:
+    """
+    streams the (gzipped) go scanner results in record batches of about block_size bytes
+    older results files have less columns, the missing ones are filled like process_go_results does
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    opener = gzip.open if load_fname.endswith(".gz") else open
+    with opener(load_fname, "rt", encoding="utf-8") as input_file:
+        first_line = input_file.readline()
+    if not first_line:
+        return
+    names = GO_COLUMNS[:len(first_line.replace('"', '').strip().split(";"))]
+    defaults = {"ts_resp": "", "dns_flags": "-1", "dns_ttl": "-1"}
+
+    reader = pacsv.open_csv(
+        load_fname,
+        read_options=pacsv.ReadOptions(column_names=names, block_size=block_size),
+        parse_options=pacsv.ParseOptions(delimiter=";", quote_char='"', invalid_row_handler=lambda row: "skip"),
+        convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in names},
+                                             strings_can_be_null=False, quoted_strings_can_be_null=False),
+    )
+    for record_batch in reader:
+        batch = pl.from_arrow(record_batch)
+        yield batch.with_columns(pl.lit(value).alias(col) for col, value in defaults.items() if col not in names)
+
+
+def process_go_results_columnar(load_fname: str, writer: ShardWriter, reference_ip: str, workers: int,
+                                block_size: int = 64 << 20):
+    """batches are classified concurrently while the next ones are read, the output keeps the input order"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        classify_batch = lambda batch: classify_go_batch(batch, reference_ip)  # noqa: E731
+        for frame in prefetch(executor, classify_batch, go_result_batches(load_fname, block_size), workers):
+            writer.write_frame(frame.with_columns(pl.col("dns_flags", "dns_ttl").cast(pl.Int64, strict=False)))
@@ -24,8 +24,15 @@ if [ -n "$3" ]; then
     intersect_out=$3
 fi
 
+resolver_counts_file="uniq_resolver_forwarders.csv"
+if [ -n "$4" ]; then
+    resolver_counts_file=$4
+fi
+
+source .venv/bin/activate
+
 echo "accumulating unique resolvers"
-zcat $input_file | grep ";Transparent" | cut -d ";" -f 3 | tail -n +2 | sort | uniq | shuf > $TEMP_UNIQ_RESOLVERS_PATH
+python ratelimit/uniq_resolvers.py $input_file $TEMP_UNIQ_RESOLVERS_PATH --counts $resolver_counts_file
 echo "there are $(cat $TEMP_UNIQ_RESOLVERS_PATH | wc -l) unique resolvers"
 
 if [ ! -f  $CONFIG_FILE ]; then
@@ -39,7 +46,6 @@ sudo rm $TEMP_UNIQ_RESOLVERS_PATH
 echo "there are $(cat $scan_output_file | wc -l) public resolvers"
 
 echo "determining negated intersection of public and restrictive resolvers"
-source .venv/bin/activate
 python ratelimit/intersect.py $scan_output_file $input_file $intersect_out
 
 echo "starting ratelimit testing"
@@ -1,20 +1,109 @@
 #! ../../venv/bin/python
+"""
+Transparent forwarders of a scan whose resolver (ip_response) did not answer the public resolver scan,
+i.e. the targets for rate limit testing of shielded resolvers.
+
+IPv4 addresses are parsed column-wise into uint32 values, the public resolvers form a sorted
+uint32 array and every forwarder is looked up with a binary search (sorted-array anti-join).
+The complete scan file is streamed in batches, so only the resolver array and one batch are in memory.
+The rows are written unchanged and in the order of the complete scan file.
+"""
+import gzip
 import sys
 import os
-import pandas as pd
+from typing import Iterator
+
 import numpy as np
-import socket, struct
+import polars as pl
+
+# a record of the resolver scan needs to point to our reference A record
+REFERENCE_ARECORD = "91.216.216.216"
+TRANSPARENT_FORWARDER = "Transparent Forwarder"
+# columns of the go scanner results: id;ip_request;ip_response;a_record;...
+RESOLVER_IP_COLUMN = 2
+ARECORD_COLUMN = 3
+
+# bytes per batch, pyarrow reads a few batches ahead
+BLOCK_SIZE = 4 << 20
+
+
+# the IPv4 helpers of the scripts in this tree, uniq_resolvers.py and fingerprinting/combine_results.py
+# import them from here
+
+
+def _parse_ipv4(ips: pl.Series) -> pl.Series:
+    # the string is split once, the octets are then cast and combined as plain columns
+    octets = ips.str.splitn(".", 4).cast(pl.Struct({f"field_{i}": pl.UInt32 for i in range(4)}), strict=False)
+    octet = [pl.col(f"field_{i}") for i in range(4)]
+    value = (octet[0] * (1 << 24) + octet[1] * (1 << 16) + octet[2] * (1 << 8) + octet[3]).cast(pl.UInt32)
+    return octets.struct.unnest().select(pl.when(*(o <= 255 for o in octet)).then(value).alias(ips.name)).to_series()
+
+
+def ipv4_to_uint32(ips: pl.Expr) -> pl.Expr:
+    """dotted IPv4 addresses to uint32, anything that is not an address becomes null"""
+    return ips.map_batches(_parse_ipv4, return_dtype=pl.UInt32, is_elementwise=True)
+
 
-def ip2long(ip):
-    return struct.unpack("!L", socket.inet_aton(ip))[0]
+def uint32_to_ipv4(values: pl.Expr) -> pl.Expr:
+    """uint32 values to dotted IPv4 addresses"""
+    return pl.concat_str([(values // (1 << shift) % 256).cast(pl.String) for shift in (24, 16, 8, 0)], separator=".")
+
+
+def public_resolvers(resolvers_scan_fname: str) -> np.ndarray:
+    """sorted unique uint32 addresses of the resolvers that answered with the reference A record"""
+    with (gzip.open if resolvers_scan_fname.endswith(".gz") else open)(resolvers_scan_fname, "rt") as f:
+        n_columns = len(f.readline().split(";"))
+    resolvers = (
+        pl.scan_csv(resolvers_scan_fname, separator=";", has_header=False, quote_char=None,
+                    schema={f"column_{i}": pl.String for i in range(n_columns)})
+        .select(ip_response=pl.col(f"column_{RESOLVER_IP_COLUMN}"), a_record=pl.col(f"column_{ARECORD_COLUMN}"))
+        .filter(pl.col("a_record").str.contains(REFERENCE_ARECORD, literal=True))  # sanity check
+        .select(ipv4_to_uint32(pl.col("ip_response")).alias("ip_response"))
+        .drop_nulls()
+        .collect()
+    )
+    return np.unique(resolvers["ip_response"].to_numpy())
+
+
+def scan_batches(complete_scan_fname: str, block_size: int = BLOCK_SIZE) -> Iterator[pl.DataFrame]:
+    """streams the complete scan file (csv(.gz) or parquet), every value is kept as read"""
+    if complete_scan_fname.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for record_batch in pq.ParquetFile(complete_scan_fname).iter_batches():
+            yield pl.from_arrow(record_batch)
+        return
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    with (gzip.open if complete_scan_fname.endswith(".gz") else open)(complete_scan_fname, "rt") as f:
+        names = f.readline().strip().split(";")
+    reader = pacsv.open_csv(
+        complete_scan_fname,
+        read_options=pacsv.ReadOptions(block_size=block_size),
+        parse_options=pacsv.ParseOptions(delimiter=";"),
+        convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in names},
+                                             strings_can_be_null=False, quoted_strings_can_be_null=False),
+    )
+    for record_batch in reader:
+        yield pl.from_arrow(record_batch)
+
+
+def shielded_forwarders(batch: pl.DataFrame, resolvers: np.ndarray) -> pl.DataFrame:
+    """the transparent forwarders of the batch whose ip_response is not in the sorted resolvers array"""
+    tfwds = batch.filter(pl.col("response_type") == TRANSPARENT_FORWARDER)
+    ips = tfwds.select(ipv4_to_uint32(pl.col("ip_response").cast(pl.String))).to_series()
+    keep = ips.is_not_null().to_numpy()
+    values = ips.fill_null(0).to_numpy()
+    if len(resolvers):
+        pos = np.minimum(np.searchsorted(resolvers, values), len(resolvers) - 1)
+        keep &= resolvers[pos] != values
+    return tfwds.filter(pl.Series(keep))
 
-def long2ip(ip):
-    return socket.inet_ntoa(struct.pack('!L', ip))
 
 if __name__ == "__main__":
     if len(sys.argv) < 4:
         print("check input args: python intersect.py <resolvers_scan_file> <complete_scan_file> <output_file>")
-    
+        exit(1)
+
     resolvers_scan_fname = sys.argv[1]
     complete_scan_fname = sys.argv[2]
     output_fname = sys.argv[3]
@@ -22,21 +111,14 @@ if __name__ == "__main__":
     if not os.path.isfile(resolvers_scan_fname) or not os.path.isfile(complete_scan_fname):
         print("one of the input files does not exist")
         exit(1)
-    
-    # pandas part
-    # read the two files as dataframes
-    resolver_df = pd.read_csv(resolvers_scan_fname, sep=';', names=['id','ip_request','ip_response','a_record','ts','port','dnsid'], usecols=['ip_response','a_record'], converters={"ip_response":ip2long})
-    resolver_df = resolver_df[resolver_df['a_record'].notna()]
-    resolver_df = resolver_df[resolver_df.a_record.str.contains("91.216.216.216")] # sanity check
-    print(resolver_df.head())
-    resolver_df = resolver_df.drop("a_record", axis=1)
-    scan_df = pd.read_csv(complete_scan_fname, sep=';', converters={"ip_response":ip2long})
-    scan_df = scan_df[scan_df["response_type"] == "Transparent Forwarder"]
-    print(scan_df.head())
-    print("dataframes read")
-
-    # join on common response ips
-    not_intersect_df = pd.merge(scan_df, resolver_df, indicator=True, how='outer').query('_merge=="left_only"').drop('_merge', axis=1)
-    not_intersect_df['ip_response'] = not_intersect_df['ip_response'].apply(lambda ip: long2ip(ip))
-    print(not_intersect_df)
-    not_intersect_df.to_csv(output_fname, sep=";", index=False)
\ No newline at end of file
+
+    resolvers = public_resolvers(resolvers_scan_fname)
+    print(f"{len(resolvers)} public resolvers")
+
+    rows = 0
+    with (gzip.open if output_fname.endswith(".gz") else open)(output_fname, "wb") as output_file:
+        for idx, batch in enumerate(scan_batches(complete_scan_fname)):
+            shielded = shielded_forwarders(batch, resolvers)
+            shielded.write_csv(output_file, separator=";", include_header=idx == 0)
+            rows += shielded.height
+    print(f"{rows} transparent forwarders of shielded resolvers written to {output_fname}")
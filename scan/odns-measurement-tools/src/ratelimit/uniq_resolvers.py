@@ -0,0 +1,78 @@
+#! ../../venv/bin/python
+"""
+Unique resolvers behind the transparent forwarders of an udp scan, the input of the public resolver scan.
+
+The scan is streamed once. The response addresses (resolvers) and request addresses (forwarders)
+of the transparent forwarders are parsed into uint32 values and deduplicated as uint64
+(resolver, forwarder) pairs. From these pairs follow both outputs:
+ - the target list: every resolver once, shuffled with a fixed seed,
+ - the number of distinct transparent forwarders per resolver.
+Columns are looked up by the header of the scan, not by their position.
+"""
+import argparse
+import time
+
+import numpy as np
+import polars as pl
+
+from intersect import TRANSPARENT_FORWARDER, ipv4_to_uint32, scan_batches, uint32_to_ipv4
+
+# unique pairs are compacted once this many are buffered
+COMPACT_PAIRS = 1 << 24
+
+
+def forwarder_pairs(batch: pl.DataFrame) -> np.ndarray:
+    """unique resolver << 32 | forwarder keys of the transparent forwarders of the batch"""
+    ips = (
+        batch.lazy()
+        .filter(pl.col("response_type") == TRANSPARENT_FORWARDER)
+        .select(resolver=ipv4_to_uint32(pl.col("ip_response").cast(pl.String)),
+                forwarder=ipv4_to_uint32(pl.col("ip_request").cast(pl.String)))
+        .drop_nulls()
+        .collect()
+    )
+    return np.unique((ips["resolver"].to_numpy().astype(np.uint64) << np.uint64(32))
+                     | ips["forwarder"].to_numpy().astype(np.uint64))
+
+
+def unique_pairs(scan_fname: str) -> np.ndarray:
+    """sorted unique (resolver, forwarder) keys of the whole scan"""
+    pairs, buffered = [np.empty(0, dtype=np.uint64)], 0
+    for batch in scan_batches(scan_fname):
+        pairs.append(forwarder_pairs(batch))
+        buffered += len(pairs[-1])
+        if buffered > COMPACT_PAIRS:
+            pairs = [np.unique(np.concatenate(pairs))]
+            buffered = len(pairs[0])
+    return np.unique(np.concatenate(pairs))
+
+
+def resolver_counts(pairs: np.ndarray) -> pl.DataFrame:
+    """resolver_ip | forwarders, the resolvers with the most forwarders first"""
+    resolvers, counts = np.unique((pairs >> np.uint64(32)).astype(np.uint32), return_counts=True)
+    return (
+        pl.DataFrame({"resolver": resolvers, "forwarders": counts})
+        .sort(["forwarders", "resolver"], descending=[True, False])
+        .select(resolver_ip=uint32_to_ipv4(pl.col("resolver")), forwarders=pl.col("forwarders"))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="unique resolvers of the transparent forwarders of an udp scan")
+    parser.add_argument("input", type=str, help="udp scan results (.csv, .csv.gz or .parquet) with a header")
+    parser.add_argument("output", type=str, help="shuffled list of the unique resolvers, one address per line")
+    parser.add_argument("--counts", type=str, default=None,
+                        help="csv file for the number of transparent forwarders per resolver")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the shuffle")
+    args = parser.parse_args()
+
+    start_t = time.time()
+    pairs = unique_pairs(args.input)
+    counts = resolver_counts(pairs)
+    targets = counts["resolver_ip"].to_numpy()
+    targets = targets[np.random.default_rng(args.seed).permutation(len(targets))]
+    with open(args.output, "w") as output_file:
+        output_file.writelines(f"{ip}\n" for ip in targets)
+    if args.counts is not None:
+        counts.write_csv(args.counts, separator=";")
+    print(f"{len(targets)} unique resolvers of {len(pairs)} transparent forwarders ({time.time() - start_t:.1f}s)")
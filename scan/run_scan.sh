@@ -31,9 +31,8 @@ if [ "$1" == "udp" ]; then
 	source .venv/bin/activate
     pip install -r requirements.txt
 	# classify by resolver type
-	python3 postprocessing/postproc_data_udp_pure.py udp_results.csv.gz $RESULTS_DIR/udp_${RESULTS_MIDFIX}_${cur_ts}.csv 2>&1 | ts "[NATIVE-POST] %Y/%m/%d %H:%M:%S"
+	python3 postprocessing/postproc_data_udp_pure.py udp_results.csv.gz $RESULTS_DIR/udp_${RESULTS_MIDFIX}_${cur_ts}.csv.gz 2>&1 | ts "[NATIVE-POST] %Y/%m/%d %H:%M:%S"
 	deactivate
-	gzip $RESULTS_DIR/udp_${RESULTS_MIDFIX}_${cur_ts}.csv
 	rm udp_results.csv.gz
 elif [ "$1" == "tcp" ]; then
 	echo "commencing tcp scan" | ts "[BASH] %Y/%m/%d %H:%M:%S"